@@ -0,0 +1,67 @@
+"""Times computing the cache-busting tables of a large static folder:
+reading and hashing every file one by one as before, hashing in
+parallel without a manifest, and with an up to date manifest."""
+
+import hashlib
+import os
+import tempfile
+import time
+
+from teknologkoren_se.lib import cache_bust
+
+FILES = 2000
+FILE_SIZE = 100 * 1024
+
+
+def make_static_folder(directory):
+    for i in range(FILES):
+        subdirectory = os.path.join(directory, 'dir{}'.format(i % 20))
+        os.makedirs(subdirectory, exist_ok=True)
+        with open(os.path.join(subdirectory, '{}.bin'.format(i)), 'wb') as f:
+            f.write(os.urandom(FILE_SIZE))
+
+
+def hash_all(static_folder):
+    """Compute the versions the way init_cache_busting() used to."""
+    versions = {}
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        for filename in filenames:
+            rooted_filename = os.path.join(dirpath, filename)
+            with open(rooted_filename, 'rb') as f:
+                version = 'c' + hashlib.md5(f.read()).hexdigest()[:7]
+            versions[os.path.relpath(rooted_filename, static_folder)] = version
+    return versions
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench(directory):
+    static_folder = os.path.join(directory, 'static')
+    manifest_path = os.path.join(directory, 'manifest.json')
+    make_static_folder(static_folder)
+
+    assert hash_all(static_folder) == cache_bust.compute_versions(
+        static_folder, manifest_path)
+
+    def cold():
+        os.remove(manifest_path)
+        cache_bust.compute_versions(static_folder, manifest_path)
+
+    def warm():
+        cache_bust.compute_versions(static_folder, manifest_path)
+
+    print("{} files of {} kB, {} cpus".format(
+        FILES, FILE_SIZE // 1024, os.cpu_count()))
+    print("read and hash all: {:6.0f} ms".format(
+        timed(lambda: hash_all(static_folder)) * 1e3))
+    print("   no manifest:    {:6.0f} ms".format(timed(cold) * 1e3))
+    print("   with manifest:  {:6.0f} ms".format(timed(warm) * 1e3))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        bench(directory)
@@ -0,0 +1,76 @@
+"""Compares formatting the dates of a 50 event listing with Babel on
+every call, as the templates used to, to the cached helpers in
+locale."""
+
+import datetime
+import timeit
+
+import babel.dates
+import flask
+
+from teknologkoren_se import locale
+
+EVENTS = 50
+
+# The formats used for each event in the listing.
+FORMATS = [
+    ('datetime', "yyyy-MM-ddTHH:mmZ"),
+    ('datetime', "EEEE dd MMMM yyyy, HH:mm"),
+    ('date', "dd MMMM yyyy"),
+]
+
+
+def uncached(kind, value, format):
+    lang_code = locale.get_locale()
+
+    if kind == 'date':
+        return babel.dates.format_date(value, format, locale=lang_code)
+
+    return babel.dates.format_datetime(value, format,
+                                       tzinfo=locale.TIMEZONE,
+                                       locale=lang_code)
+
+
+def listing(format_value, times):
+    return [format_value(kind, time, format)
+            for time in times
+            for kind, format in FORMATS]
+
+
+def bench():
+    start = datetime.datetime(2026, 1, 1, 19, 0)
+    times = [start + datetime.timedelta(days=7 * i, minutes=i)
+             for i in range(EVENTS)]
+
+    app = flask.Flask(__name__)
+
+    for lang_code in ('sv', 'en'):
+        with app.test_request_context():
+            flask.g.lang_code = lang_code
+
+            assert listing(uncached, times) == listing(locale.format_value,
+                                                       times)
+
+            def babel():
+                return listing(uncached, times)
+
+            def cold():
+                locale.format_cached.cache_clear()
+                return listing(locale.format_value, times)
+
+            def warm():
+                return listing(locale.format_value, times)
+
+            results = [
+                (function.__name__,
+                 min(timeit.repeat(function, number=20, repeat=5)) / 20)
+                for function in (babel, cold, warm)
+            ]
+
+        print("{}: {}".format(lang_code, ", ".join(
+            "{} {:.2f} ms".format(name, time * 1e3)
+            for name, time in results)))
+
+
+if __name__ == "__main__":
+    bench()
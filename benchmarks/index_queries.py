@@ -0,0 +1,98 @@
+"""Counts the queries made to render the front page with more and more
+of its posts being events.
+
+Events are loaded together with the other posts, so the number of
+queries should not depend on how many of the posts are events.
+"""
+
+import datetime
+import os
+import tempfile
+
+import sqlalchemy as sqla
+
+from teknologkoren_se import factory, models
+from teknologkoren_se.views import public
+
+
+def make_app(directory):
+    return factory.create_app(config={
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'UPLOADS_DEFAULT_DEST': os.path.join(directory, 'uploads'),
+        'CACHE_GENERATION_FILE': os.path.join(directory, 'generation'),
+        'CACHE_BUST_MANIFEST': os.path.join(directory, 'manifest.json'),
+        'RESPONSE_CACHE': False,
+    })
+
+
+def populate(app, events):
+    """Add a front page of posts, `events` of them events, all with
+    images, and a frontpage image."""
+    models.db.drop_all()
+    factory.init_db(app)
+
+    now = datetime.datetime.utcnow()
+    config = models.Config.query.first()
+    config.frontpage_image = models.Image(filename='cover.jpg')
+
+    for i in range(public.POSTS_PER_PAGE):
+        fields = dict(
+            published=now - datetime.timedelta(days=i),
+            title_sv="Inlägg {}".format(i),
+            text_sv="Text",
+            image=models.Image(filename='{}.jpg'.format(i), portrait=False)
+        )
+
+        if i < events:
+            post = models.Event(
+                start_time=now + datetime.timedelta(days=i),
+                location_sv="Plats",
+                time_text_sv="Kl. 19:00",
+                **fields
+            )
+        else:
+            post = models.BlogPost(**fields)
+
+        models.db.session.add(post)
+
+    models.db.session.commit()
+
+
+def count_queries(client, url):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sqla.event.listen(models.db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        sqla.event.remove(models.db.engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200
+    return len(statements)
+
+
+def bench(app):
+    counts = {}
+
+    for events in range(public.POSTS_PER_PAGE + 1):
+        with app.app_context():
+            populate(app, events)
+
+            client = app.test_client()
+            # The first request also loads the config.
+            client.get('/sv/')
+
+            counts[events] = count_queries(client, '/sv/')
+
+        print("{} of {} posts events: {} queries".format(
+            events, public.POSTS_PER_PAGE, counts[events]))
+
+    assert len(set(counts.values())) == 1, "Queries depend on events"
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        bench(make_app(directory))
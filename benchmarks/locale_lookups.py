@@ -0,0 +1,59 @@
+"""Counts how often the locale is asked for while rendering pages, and
+how many of those calls resolve it from g, the session and the request.
+
+Before the locale was kept per request, every call resolved it.
+"""
+
+import cProfile
+import os
+import pstats
+import random
+import tempfile
+
+from teknologkoren_se import factory, locale
+
+URLS = ['/sv/', '/en/', '/sv/konserter/', '/sv/kontakt', '/en/om-oss']
+
+
+def make_app(directory):
+    return factory.create_app(config={
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'UPLOADS_DEFAULT_DEST': os.path.join(directory, 'uploads'),
+        'CACHE_GENERATION_FILE': os.path.join(directory, 'generation'),
+        'CACHE_BUST_MANIFEST': os.path.join(directory, 'manifest.json'),
+        'RESPONSE_CACHE': False,
+    })
+
+
+def calls(profile, function):
+    code = function.__code__
+    key = (code.co_filename, code.co_firstlineno, code.co_name)
+    stats = pstats.Stats(profile).stats
+    return stats[key][1] if key in stats else 0
+
+
+def bench(app):
+    random.seed(0)
+    with app.app_context():
+        factory.init_db(app)
+        factory.populate_testdb()
+
+    client = app.test_client()
+
+    for url in URLS:
+        profile = cProfile.Profile()
+        profile.enable()
+        response = client.get(url)
+        profile.disable()
+
+        assert response.status_code == 200
+
+        print("{:>15}: {:4} get_locale() calls, {} resolved".format(
+            url,
+            calls(profile, locale.get_locale),
+            calls(profile, locale.resolve_locale)))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        bench(make_app(directory))
@@ -0,0 +1,49 @@
+"""Compares rendering with a new Markdown instance per call (as
+markdown.markdown() does) to rendering with a reused converter."""
+
+import timeit
+
+import markdown
+
+from teknologkoren_se import rendering
+
+N = 2000
+
+with open('teknologkoren_se/lorem_paragraphs.txt') as f:
+    paragraphs = [l.strip() for l in f.readlines()]
+
+TEXTS = [
+    ('time text', "Kl. 19:00\nInsläpp 18:30, https://example.com/biljetter"),
+    ('post', "# Rubrik\n\n" + '\n\n'.join(paragraphs[:2])),
+]
+
+
+def bench():
+    variant = rendering.post_variant(1)
+
+    for name, text in TEXTS:
+        def fresh():
+            return markdown.markdown(
+                text,
+                extensions=list(variant.extensions),
+                extension_configs=variant.configs
+            )
+
+        def pooled():
+            return variant.render(text)
+
+        assert fresh() == pooled()
+
+        fresh_time = min(timeit.repeat(fresh, number=N, repeat=5)) / N
+        pooled_time = min(timeit.repeat(pooled, number=N, repeat=5)) / N
+
+        print("{:>10}: fresh {:7.1f} µs, pooled {:7.1f} µs, "
+              "saved {:6.1f} µs/render".format(
+                  name,
+                  fresh_time * 1e6,
+                  pooled_time * 1e6,
+                  (fresh_time - pooled_time) * 1e6))
+
+
+if __name__ == "__main__":
+    bench()
@@ -18,6 +18,22 @@ SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(BASEDIR.joinpath('db.sqlite'))
 # True or False to suppress this warning.
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Cache rendered public pages in memory, see teknologkoren_se/cache.py.
+# Never used in debug mode.
+RESPONSE_CACHE = True
+RESPONSE_CACHE_SIZE = 1000
+
+# Serve cache busted static files from memory, with brotli and gzip
+# encodings, see teknologkoren_se/static_assets.py. Never used in debug
+# mode.
+STATIC_IN_MEMORY = True
+
+# Uploaded images are turned as shown, converted to sRGB, stripped of
+# metadata and scaled down to at most IMAGE_MAX_DIMENSION pixels on their
+# longest side, see teknologkoren_se/images.py.
+IMAGE_MAX_DIMENSION = 3200
+IMAGE_QUALITY = 85
+
 UPLOADS_DEFAULT_DEST = BASEDIR.joinpath('teknologkoren_se/static/uploads')
 UPLOADS_DEFAULT_URL = '/static/uploads/'
 
@@ -0,0 +1,24 @@
+"""Adds dimensions, size and placeholder of images to files
+
+Only changes the schema. Run `flask image-metadata` after all migrations
+have been run to read the metadata of existing images.
+"""
+
+import sqlite3
+
+conn = sqlite3.connect('instance/db.sqlite')
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+
+def migrate():
+    c.execute('ALTER TABLE file ADD COLUMN width INTEGER')
+    c.execute('ALTER TABLE file ADD COLUMN height INTEGER')
+    c.execute('ALTER TABLE file ADD COLUMN size INTEGER')
+    c.execute('ALTER TABLE file ADD COLUMN placeholder TEXT')
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    migrate()
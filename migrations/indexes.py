@@ -0,0 +1,22 @@
+"""Adds indexes used by the public views"""
+
+import sqlite3
+
+conn = sqlite3.connect('instance/db.sqlite')
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+
+def migrate():
+    c.execute('CREATE INDEX ix_post_published ON post (published)')
+    c.execute(
+        'CREATE INDEX ix_post_type_published ON post (type, published)'
+    )
+    c.execute('CREATE INDEX ix_page_path ON page (path)')
+    c.execute('CREATE INDEX ix_contact_weight ON contact (weight)')
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,22 @@
+"""Adds columns for normalized phone numbers to contacts
+
+Only changes the schema. Run `flask normalize-phones` after all migrations
+have been run to normalize the numbers of existing contacts.
+"""
+
+import sqlite3
+
+conn = sqlite3.connect('instance/db.sqlite')
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+
+def migrate():
+    c.execute('ALTER TABLE contact ADD COLUMN phone_e164 VARCHAR(16)')
+    c.execute('ALTER TABLE contact ADD COLUMN phone_display VARCHAR(30)')
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,23 @@
+"""Adds columns for prerendered html to posts and pages
+
+Only changes the schema. Run `flask prerender` after all migrations
+have been run to render the markdown of existing posts and pages.
+"""
+
+import sqlite3
+
+conn = sqlite3.connect('instance/db.sqlite')
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+
+def migrate():
+    for table in ('post', 'page'):
+        c.execute('ALTER TABLE {} ADD COLUMN rendered_sv JSON'.format(table))
+        c.execute('ALTER TABLE {} ADD COLUMN rendered_en JSON'.format(table))
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    migrate()
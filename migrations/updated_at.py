@@ -0,0 +1,23 @@
+"""Adds updated_at timestamps to posts, pages, contacts and config"""
+
+import sqlite3
+
+conn = sqlite3.connect('instance/db.sqlite')
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+
+def migrate():
+    for table in ('post', 'page', 'contact', 'config'):
+        c.execute(
+            'ALTER TABLE {} ADD COLUMN updated_at DATETIME'.format(table)
+        )
+        c.execute(
+            "UPDATE {} SET updated_at = datetime('now')".format(table)
+        )
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,21 @@
+"""Adds versions of uploaded files to files and images
+
+Only changes the schema. Run `flask version-uploads` after all migrations
+have been run to version existing uploads.
+"""
+
+import sqlite3
+
+conn = sqlite3.connect('instance/db.sqlite')
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+
+def migrate():
+    c.execute('ALTER TABLE file ADD COLUMN version VARCHAR(8)')
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,321 @@
+import datetime
+import functools
+import hashlib
+import itertools
+import os
+import threading
+import uuid
+
+import flask
+import sqlalchemy as sqla
+import werkzeug.http
+
+from teknologkoren_se import models
+from teknologkoren_se.locale import get_locale
+
+# Changes to instances of these models invalidate cached pages.
+CONTENT_MODELS = (
+    models.Post,
+    models.Page,
+    models.Contact,
+    models.Config,
+    models.File,
+)
+
+
+class Generation:
+    """A marker shared by all worker processes, changed on every commit
+    of content.
+
+    The marker is a file that is replaced on every bump, so checking
+    whether it has changed costs a single stat().
+    """
+
+    def __init__(self):
+        self.path = None
+
+    def init_app(self, app):
+        self.path = (app.config.get('CACHE_GENERATION_FILE')
+                     or os.path.join(app.instance_path, 'cache_generation'))
+
+    def current(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def bump(self):
+        if self.path is None:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        token = uuid.uuid4().hex
+        tmp_path = '{}.{}'.format(self.path, token)
+        with open(tmp_path, 'w') as f:
+            f.write(token)
+
+        os.replace(tmp_path, self.path)
+
+
+generation = Generation()
+
+
+def generation_time(current):
+    """Return when the `current` generation was made, in UTC, or None."""
+    if current is None:
+        return None
+
+    return datetime.datetime.utcfromtimestamp(current[1] / 1e9)
+
+
+class ResponseCache:
+    """Rendered responses of public views, per worker process.
+
+    The cache is emptied when the generation changes and when the next
+    scheduled post is published.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.clear(None)
+
+    def clear(self, generation):
+        self.entries = {}
+        self.generation = generation
+        # When the cache should be emptied as the next post is published,
+        # looked up when the first response is stored.
+        self.expires = None
+        self.expires_known = False
+
+    def validate(self):
+        """Empty the cache if it is out of date, and return the current
+        generation."""
+        current = generation.current()
+
+        with self.lock:
+            expired = (
+                self.expires is not None
+                and self.expires <= datetime.datetime.utcnow()
+            )
+            if current != self.generation or expired:
+                self.clear(current)
+
+        return current
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        data, status, headers = entry
+        return flask.current_app.response_class(data, status, headers)
+
+    def set(self, key, response, generation):
+        if not self.expires_known:
+            expires = next_publication()
+
+        with self.lock:
+            if generation != self.generation:
+                # Content changed while the response was rendered.
+                return
+
+            if not self.expires_known:
+                self.expires = expires
+                self.expires_known = True
+
+            if len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]
+
+            self.entries[key] = (
+                response.get_data(),
+                response.status,
+                list(response.headers),
+            )
+
+
+responses = ResponseCache()
+
+
+class ConfigCache:
+    """The site's Config and its frontpage image, per worker process.
+
+    They are kept detached from any session with all attributes loaded,
+    and are reloaded when the generation changes.
+    """
+
+    def __init__(self):
+        self.config = None
+        self.generation = None
+
+    def get(self):
+        current = generation.current()
+
+        if self.config is None or current != self.generation:
+            # The frontpage image is loaded with the config.
+            config = models.Config.query.first()
+
+            if config is not None:
+                if config.frontpage_image is not None:
+                    models.db.session.expunge(config.frontpage_image)
+                models.db.session.expunge(config)
+
+            self.config = config
+            self.generation = current
+
+        return self.config
+
+
+config_cache = ConfigCache()
+
+
+def get_config():
+    """Return the site's Config, without querying unless it changed."""
+    return config_cache.get()
+
+
+def next_publication():
+    """Return when the next scheduled post is published, if any."""
+    return (
+        models.db.session.query(models.Post.published)
+        .filter(models.Post.published > datetime.datetime.utcnow())
+        .order_by(models.Post.published)
+        .limit(1)
+        .scalar()
+    )
+
+
+# Changes whenever the code or templates of the site change, so that
+# validators of pages change with them. Set by init_app().
+site_version = None
+
+
+def find_site_version(app):
+    """Return the latest modification time of the site's code and
+    templates."""
+    latest = 0
+    for dirpath, dirnames, filenames in os.walk(app.root_path):
+        if dirpath == app.root_path and 'static' in dirnames:
+            dirnames.remove('static')
+        for filename in filenames:
+            mtime = os.stat(os.path.join(dirpath, filename)).st_mtime_ns
+            latest = max(latest, mtime)
+    return latest
+
+
+def init_app(app):
+    global site_version
+    site_version = find_site_version(app)
+
+    generation.init_app(app)
+    responses.max_entries = app.config['RESPONSE_CACHE_SIZE']
+
+
+def cached(view):
+    """Serve responses of `view` from the response cache.
+
+    Responses are cached per language, endpoint and view arguments, only
+    successful responses are cached.
+    """
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+        app = flask.current_app
+        if (app.debug or not app.config['RESPONSE_CACHE']
+                or '_flashes' in flask.session):
+            # Pending flashes would be shown in the rendered page.
+            return view(**kwargs)
+
+        current_generation = responses.validate()
+        key = (get_locale(), flask.request.endpoint,
+               tuple(sorted(kwargs.items())))
+
+        response = responses.get(key)
+        if response is not None:
+            return response.make_conditional(flask.request)
+
+        response = flask.make_response(view(**kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            responses.set(key, response, current_generation)
+
+        return response
+
+    return wrapper
+
+
+def latest(*times):
+    """Return the latest of `times`, ignoring None."""
+    return max((time for time in times if time), default=None)
+
+
+def conditional(validators):
+    """Answer conditional requests to a view before it is called.
+
+    `validators` is called with the view arguments and returns a tuple
+    with when the page was last modified, followed by anything else that
+    changes the page. The ETag of the page is made from these, the site
+    version, the generation and the language. The page is also last
+    modified no earlier than the generation was made. As the generation
+    changes with every commit of content, deleted rows and replaced
+    files change both even though they leave no timestamp behind. If
+    `validators` returns None, the view is called as usual.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if '_flashes' in flask.session:
+                return view(**kwargs)
+
+            values = validators(**kwargs)
+            if values is None:
+                return view(**kwargs)
+
+            current_generation = generation.current()
+            etag = hashlib.sha1(repr((
+                site_version,
+                current_generation,
+                get_locale(),
+                values
+            )).encode()).hexdigest()
+            last_modified = latest(values[0],
+                                   generation_time(current_generation))
+
+            if not werkzeug.http.is_resource_modified(
+                    flask.request.environ,
+                    etag=etag,
+                    last_modified=last_modified):
+                response = flask.current_app.response_class(status=304)
+            else:
+                response = flask.make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+@sqla.event.listens_for(sqla.orm.Session, 'after_flush')
+def note_content_changes(session, flush_context):
+    changed = itertools.chain(session.new, session.dirty, session.deleted)
+    if any(isinstance(obj, CONTENT_MODELS) for obj in changed):
+        session.info['content_changed'] = True
+
+
+@sqla.event.listens_for(sqla.orm.Session, 'after_commit')
+def bump_generation(session):
+    if session.info.pop('content_changed', False):
+        generation.bump()
+
+
+@sqla.event.listens_for(sqla.orm.Session, 'after_rollback')
+def forget_content_changes(session):
+    session.info.pop('content_changed', None)
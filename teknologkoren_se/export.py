@@ -0,0 +1,259 @@
+"""Export of the public site as static files.
+
+The export directory can be served directly by nginx, e.g.
+
+    location /static/ {
+        root /path/to/export;
+        expires max;
+    }
+    location /static/uploads/ {
+        alias /path/to/uploads/;
+        expires max;
+    }
+    location ~ ^/static/uploads/images/(img\d+/[^/]+)$ {
+        root /path/to/uploads/derivatives;
+        expires max;
+        try_files /$1 @flask;
+    }
+    location / {
+        root /path/to/export;
+        try_files $uri $uri.html $uri/index.html @flask;
+    }
+
+Uploads are not exported, they are served from UPLOADS_DEFAULT_DEST.
+Resized images that have not been made yet are passed on to Flask, see
+images.py.
+
+Pages ending with a slash are written as `index.html` in a directory of
+that name, other pages get a `.html` suffix.
+
+When the site is served by Flask, nginx can still serve the static files
+under their cache busted names, either from a directory of links to them
+written by link_assets(),
+
+    location ~ ^/static/c[0-9a-f]{7}/ {
+        root /path/to/links;
+        expires max;
+        add_header Cache-Control immutable;
+        try_files $uri @flask;
+    }
+
+or through the map written by write_nginx_map(), included in the http
+block,
+
+    include /path/to/static_map.conf;
+    ...
+    location ~ ^/static/c[0-9a-f]{7}/ {
+        root /path/to/teknologkoren_se;
+        expires max;
+        add_header Cache-Control immutable;
+        try_files $unbusted_static @flask;
+    }
+
+Requests for names that are not in the links or map, e.g. of an older
+version, are passed on to Flask.
+"""
+
+import os
+import shutil
+
+import flask
+
+from teknologkoren_se import models, util
+from teknologkoren_se.views import public
+
+LANGUAGES = ('sv', 'en')
+
+
+def changed(query, model, since):
+    """Filter `query` on rows of `model` changed after `since`."""
+    if since is None:
+        return query
+    return query.filter(model.updated_at > since)
+
+
+def published_posts(model, since=None):
+    """Return published posts of `model`, changed or published after
+    `since` if given."""
+    posts = public.published_posts(model)
+
+    if since is not None:
+        posts = posts.filter(
+            (model.updated_at > since) | (model.published > since)
+        )
+
+    return posts.all()
+
+
+def listing_urls(endpoint, model, lang_code):
+    urls = []
+    cursor = None
+
+    while True:
+        urls.append(flask.url_for(endpoint, lang_code=lang_code,
+                                  cursor=cursor))
+
+        page = util.keyset_paginate(public.published_posts(model), model,
+                                    cursor, public.POSTS_PER_PAGE)
+        if not page.has_next:
+            return urls
+
+        cursor = page.next_cursor
+
+
+def post_url(post, lang_code):
+    if post.type == 'event':
+        endpoint, arg = 'public.view_event', 'event_id'
+    else:
+        endpoint, arg = 'public.view_post', 'post_id'
+
+    slug = post.slug_en if lang_code == 'en' and post.slug_en else post.slug_sv
+    return flask.url_for(endpoint, lang_code=lang_code, slug=slug,
+                         **{arg: post.id})
+
+
+def page_urls(since=None):
+    """Return urls of all public pages, or of the pages affected by
+    content changed after `since`."""
+    posts = published_posts(models.BlogPost, since)
+    events = published_posts(models.Event, since)
+
+    config_changed = (
+        changed(models.Config.query, models.Config, since).count()
+    )
+    contacts_changed = (
+        changed(models.Contact.query, models.Contact, since).count()
+    )
+    changed_paths = {
+        page.path for page in changed(models.Page.query, models.Page, since)
+    }
+
+    urls = []
+    for lang_code in LANGUAGES:
+        if since is None or posts or events or config_changed:
+            urls += listing_urls('public.index', models.Post, lang_code)
+
+        if since is None or events:
+            urls += listing_urls('public.events', models.Event, lang_code)
+
+        urls += [post_url(post, lang_code) for post in posts + events]
+
+        if since is None or contacts_changed:
+            urls.append(flask.url_for('public.contact', lang_code=lang_code))
+
+        for path, endpoint in public.DYNAMIC_PAGES:
+            if since is None or path in changed_paths:
+                urls.append(flask.url_for('public.' + endpoint,
+                                          lang_code=lang_code))
+
+    return urls
+
+
+def output_path(directory, url):
+    if url.endswith('/'):
+        url += 'index.html'
+    else:
+        url += '.html'
+
+    return os.path.join(directory, url.lstrip('/'))
+
+
+def export_pages(app, directory, urls):
+    """Write the pages at `urls` to `directory`, return the urls of the
+    pages written."""
+    client = app.test_client()
+    written = []
+
+    for url in urls:
+        response = client.get(url)
+        if response.status_code != 200:
+            continue
+
+        path = output_path(directory, url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(response.get_data())
+
+        written.append(url)
+
+    return written
+
+
+def busted_assets(app):
+    """Return (unbusted, busted) names of the cache busted static files.
+
+    Uploads are not included, nginx should serve them from their upload
+    destination.
+    """
+    uploads = os.path.relpath(app.config['UPLOADS_DEFAULT_DEST'],
+                              app.static_folder)
+    bust_table = app.extensions['cache_bust']['bust_table']
+
+    return [(unbusted, busted) for unbusted, busted in bust_table.items()
+            if not unbusted.startswith(uploads + os.sep)]
+
+
+def export_assets(app, directory, link=shutil.copy2):
+    """Copy static files to their cache busted paths in `directory`.
+
+    `link` is called with the source and destination path of each file
+    not already in `directory`.
+    """
+    for unbusted, busted in busted_assets(app):
+        path = os.path.join(directory, 'static', busted)
+        if os.path.lexists(path):
+            # Busted names change with the content.
+            continue
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        link(os.path.join(app.static_folder, unbusted), path)
+
+
+def link_assets(app, directory, hard=False):
+    """Link static files to their cache busted paths in `directory`.
+
+    Symbolic links follow the file, so a busted name of an older version
+    serves the current content. Hard links keep the content of the
+    version they were made for, as long as the file is replaced rather
+    than written in place, but must be on the same file system.
+    """
+    link = os.link if hard else os.symlink
+    export_assets(app, directory, link)
+
+
+def write_nginx_map(app, path):
+    """Write an nginx map from busted static urls to the paths of the
+    files, relative to the app's root path."""
+    static_path = os.path.relpath(app.static_folder, app.root_path)
+
+    lines = ['map $uri $unbusted_static {']
+    for unbusted, busted in sorted(busted_assets(app)):
+        lines.append('    /static/{} /{};'.format(
+            busted, os.path.join(static_path, unbusted)
+        ))
+    lines.append('}')
+
+    tmp_path = '{}.{}'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    # nginx may be reloaded while the map is written.
+    os.replace(tmp_path, path)
+
+
+def export_static(app, directory, since=None):
+    """Write the public site to `directory`.
+
+    If `since` is given only pages affected by content changed after it
+    are written. Changes to code or templates require a full export.
+    Pages of deleted or unpublished posts are not removed.
+
+    Returns the urls of the pages written.
+    """
+    with app.test_request_context():
+        urls = page_urls(since)
+
+    written = export_pages(app, directory, urls)
+    export_assets(app, directory)
+
+    return written
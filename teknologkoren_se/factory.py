@@ -17,9 +17,10 @@ def create_app(config=None, instance_config=None):
     register_blueprints(app)
     register_cli(app)
 
-    from teknologkoren_se import models, views, util
+    from teknologkoren_se import cache, models, views, util
 
     models.db.init_app(app)
+    cache.init_app(app)
 
     views.admin.login_manager.init_app(app)
     views.public.setup_jinja(app)
@@ -27,8 +28,17 @@ def create_app(config=None, instance_config=None):
     setup_flask_uploads(app)
     setup_locale(app)
 
+    from teknologkoren_se import images
+    images.init_app(app)
+
     from teknologkoren_se.lib import cache_bust
-    cache_bust.init_cache_busting(app)
+    # Uploads are versioned by their File rows, see models.File.
+    cache_bust.init_cache_busting(
+        app, exclude=[str(app.config['UPLOADS_DEFAULT_DEST'])]
+    )
+
+    from teknologkoren_se import static_assets
+    static_assets.init_app(app)
 
     if app.debug:
         setup_debug_mode(app)
@@ -59,6 +69,63 @@ def register_cli(app):
     def populatetestdb_command():
         populate_testdb()
 
+    @app.cli.command('prerender')
+    def prerender_command():
+        prerender_all()
+
+    @app.cli.command('normalize-phones')
+    def normalize_phones_command():
+        normalize_phones()
+
+    @app.cli.command('version-uploads')
+    def version_uploads_command():
+        version_uploads()
+
+    @app.cli.command('image-metadata')
+    def image_metadata_command():
+        image_metadata()
+
+    @app.cli.command('export-static')
+    @click.argument('directory', type=click.Path(file_okay=False))
+    @click.option('--changed-since', type=click.DateTime(),
+                  help="Only export pages affected by content changed "
+                       "after this time (UTC).")
+    def export_static_command(directory, changed_since):
+        from teknologkoren_se import export
+        urls = export.export_static(app, directory, changed_since)
+        print("Exported {} pages to {}".format(len(urls), directory))
+
+    @app.cli.command('make-derivatives')
+    @click.option('--workers', type=int,
+                  help="Number of worker processes, one per CPU if not "
+                       "given.")
+    def make_derivatives_command(workers):
+        from teknologkoren_se import images, models
+        filenames = [image.filename for image in models.Image.query]
+        count = images.make_all_derivatives(app, filenames, workers)
+        print("Made derivatives of {} images".format(count))
+
+    @app.cli.command('link-static')
+    @click.argument('directory', type=click.Path(file_okay=False))
+    @click.option('--hard', is_flag=True,
+                  help="Make hard links instead of symbolic links.")
+    def link_static_command(directory, hard):
+        from teknologkoren_se import export
+        export.link_assets(app, directory, hard)
+        print("Linked static files to {}".format(directory))
+
+    @app.cli.command('nginx-static-map')
+    @click.argument('path', type=click.Path(dir_okay=False))
+    def nginx_static_map_command(path):
+        from teknologkoren_se import export
+        export.write_nginx_map(app, path)
+        print("Wrote nginx map to {}".format(path))
+
+    @app.cli.command('explain-queries')
+    def explain_queries_command():
+        from teknologkoren_se import query_plans
+        query_plans.print_query_plans(app)
+
     @app.cli.command('createadmin')
     def createadmin_command():
         from teknologkoren_se import models
@@ -250,6 +317,76 @@ def populate_testdb():
     models.db.session.commit()
 
 
+def prerender_all():
+    """Render and store the html of all posts, events and pages.
+
+    Texts are rendered when they are changed, this is only needed after
+    the markdown extension configuration has changed.
+    """
+    import sqlalchemy as sqla
+    from teknologkoren_se import models
+
+    options = (
+        sqla.orm.undefer_group('text'),
+        sqla.orm.undefer_group('rendered'),
+    )
+    posts = (
+        models.db.session.query(
+            sqla.orm.with_polymorphic(models.Post, [models.Event])
+        )
+        .options(*options)
+        .all()
+    )
+    pages = models.Page.query.options(*options).all()
+
+    for obj in posts + pages:
+        obj.prerender()
+
+    models.db.session.commit()
+
+
+def normalize_phones():
+    """Normalize and store the phone numbers of all contacts.
+
+    Numbers are normalized when they are changed, this is only needed
+    for contacts saved before numbers were normalized.
+    """
+    from teknologkoren_se import models
+
+    for contact in models.Contact.query.all():
+        contact.normalize_phone()
+
+    models.db.session.commit()
+
+
+def version_uploads():
+    """Store the versions of all uploaded files.
+
+    Versions are stored when files are uploaded, this is only needed for
+    files uploaded before they were versioned.
+    """
+    from teknologkoren_se import models
+
+    for file in models.File.query.all():
+        file.update_version()
+
+    models.db.session.commit()
+
+
+def image_metadata():
+    """Store the dimensions, size and placeholder of all images.
+
+    They are stored when images are uploaded, this is only needed for
+    images uploaded before they were stored.
+    """
+    from teknologkoren_se import images, models
+
+    for image in models.Image.query.all():
+        images.update_metadata(image)
+
+    models.db.session.commit()
+
+
 def init_db(app):
     from teknologkoren_se import models
     models.db.create_all()
@@ -296,67 +433,31 @@ def setup_flask_uploads(app):
 
 
 def setup_locale(app):
-    from babel.dates import (format_date, format_datetime, format_time,
-                             get_timezone)
     from teknologkoren_se import locale
     app.jinja_env.globals['locale'] = locale
     app.jinja_env.globals['_'] = locale.get_string
+    app.context_processor(locale.template_strings)
     app.jinja_env.globals['url_for_lang'] = locale.url_for_lang
 
-    cet = get_timezone('Europe/Stockholm')
-
-    # locale.get_locale() requires an application context, we either
-    # have to run get_locale() in the templates, or use lambdas here.
-    app.jinja_env.globals['format_date'] = (
-        lambda d, f: format_date(
-            d, f,
-            locale=locale.get_locale()
-        )
-    )
-    app.jinja_env.globals['format_datetime'] = (
-        lambda d, f: format_datetime(
-            d, f,
-            tzinfo=cet,
-            locale=locale.get_locale()
-        )
-    )
-    app.jinja_env.globals['format_time'] = (
-        lambda d, f: format_time(
-            d, f,
-            tzinfo=cet,
-            locale=locale.get_locale()
-        )
-    )
+    app.jinja_env.globals['format_date'] = locale.format_date
+    app.jinja_env.globals['format_datetime'] = locale.format_datetime
+    app.jinja_env.globals['format_time'] = locale.format_time
 
     app.before_request(locale.fix_missing_lang_code)
 
 
 def setup_debug_mode(app):
     def catch_image_resize(image_size, image):
-        """Redirect requests to resized images.
+        """Redirect requests to resized static images.
 
         Flask's built-in server does not understand the image resize
         path argument that nginx uses. This redirects those urls to the
-        original images.
+        original images. Uploaded images are resized by images.py.
         """
-        if flask.request.endpoint == 'image_resize':
-            non_resized_url = '/static/images/{}'
-        elif flask.request.endpoint == 'upload_resize':
-            non_resized_url = '/static/uploads/images/{}'
-        else:
-            # Why are we in this function?
-            flask.abort(500)
-
-        non_resized_url = non_resized_url.format(image)
-
-        return flask.redirect(non_resized_url)
+        return flask.redirect('/static/images/{}'.format(image))
 
     # If in debug mode, add rule for resized image paths to go through
     # the redirection function.
     app.add_url_rule('/static/images/<image_size>/<image>',
                      endpoint='image_resize',
                      view_func=catch_image_resize)
-
-    app.add_url_rule('/static/uploads/images/<image_size>/<image>',
-                     endpoint='upload_resize',
-                     view_func=catch_image_resize)
@@ -99,9 +99,10 @@ class UploadImageForm(FlaskForm):
     image = fields.FileField('Ladda upp ny bild', validators=[
         FileAllowed(util.image_uploads, 'Endast bilder!')
     ])
-    portrait = fields.BooleanField(
-        'Porträttläge',
-        description="Bilden är i porträttläge (högre än den är bred)"
+    keep_original = fields.BooleanField(
+        'Behåll originalfilen',
+        description="Bilden sparas också som den laddades upp, utan att "
+                    "förminskas eller rensas på metadata."
     )
 
 
@@ -0,0 +1,575 @@
+"""Resized copies of uploaded images.
+
+Templates ask for images of a given width with url_for_image(), which
+points at `img<width>/<filename>` under the url of the image uploads.
+The resized copy of an image, its derivative, is made on the first
+request for it and kept on disk, in IMAGE_DERIVATIVES_DEST or else in
+`derivatives` in UPLOADS_DEFAULT_DEST. Images no wider than the width
+asked for are copied as they are. Files Pillow can not read, or that
+are too large to decode, have no derivatives and are served as they
+are.
+
+Derivatives are also made in AVIF and WebP, if Pillow can write them,
+at `img<width>/<filename>.<format>`. Templates offer them with
+`<picture>` sources, see formats_for().
+
+Uploaded images are optimized before they are stored, see optimize().
+The file as uploaded is only kept if asked for, in IMAGE_ORIGINALS_DEST
+or else in `image_originals` in the instance folder. Originals must not
+be kept where they are served, as they still have their metadata.
+
+The dimensions, size and a placeholder of each image are stored on its
+Image row when its filename is set, see update_metadata().
+
+Derivatives of new and replaced images are made in a pool of worker
+processes when they are committed, so that they are ready before the
+first request. `flask make-derivatives` makes them for all images.
+
+nginx can serve derivatives that have been made directly, e.g.
+
+    location ~ ^/static/uploads/images/(img\\d+/[^/]+)$ {
+        root /path/to/teknologkoren_se/static/uploads/derivatives;
+        expires max;
+        try_files /$1 @flask;
+    }
+"""
+
+import atexit
+import base64
+import concurrent.futures
+import io
+import os
+import shutil
+import threading
+from urllib.parse import urlparse
+
+import flask
+import sqlalchemy as sqla
+import werkzeug.security
+from PIL import Image, ImageCms, ImageOps, features
+
+from teknologkoren_se import models, util
+from teknologkoren_se.static_assets import ONE_YEAR
+
+# The widths asked for by templates. Other widths are not made, so that
+# requests can not fill the disk.
+WIDTHS = (100, 200, 400, 600, 800, 1200, 1600)
+
+JPEG_QUALITY = 85
+
+# Formats derivatives are also made in, in order of preference, with the
+# name and quality Pillow saves them with.
+FORMATS = {
+    'avif': ('AVIF', 60),
+    'webp': ('WEBP', 80),
+}
+
+# The formats Pillow can write here.
+AVAILABLE_FORMATS = tuple(
+    format for format in FORMATS if features.check(format)
+)
+
+# Images that are only served in their own format. Animations would
+# lose all but their first frame and Pillow can not read SVG.
+ORIGINAL_FORMAT_ONLY = ('.gif', '.svg')
+
+
+# Formats of uploaded images that are optimized.
+OPTIMIZED_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+# Metadata removed from uploaded images, besides EXIF.
+METADATA_KEYS = ('icc_profile', 'exif', 'xmp', 'XML:com.adobe.xmp',
+                 'comment')
+
+# Width of the placeholder shown while an image loads.
+PLACEHOLDER_WIDTH = 16
+
+# EXIF orientations that turn the image a quarter.
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def formats_for(filename):
+    """Return the formats derivatives of `filename` are offered in,
+    besides its own."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in ORIGINAL_FORMAT_ONLY:
+        return ()
+
+    return tuple(format for format in AVAILABLE_FORMATS
+                 if extension != '.' + format)
+
+
+def derivatives_dest(app):
+    return (app.config.get('IMAGE_DERIVATIVES_DEST')
+            or os.path.join(app.config['UPLOADS_DEFAULT_DEST'],
+                            'derivatives'))
+
+
+def originals_dest(app):
+    return (app.config.get('IMAGE_ORIGINALS_DEST')
+            or os.path.join(app.instance_path, 'image_originals'))
+
+
+def derivative_path(app, filename, width, format=None):
+    if format:
+        filename = '{}.{}'.format(filename, format)
+
+    return os.path.join(derivatives_dest(app), 'img{}'.format(width),
+                        filename)
+
+
+def is_fresh(path, original):
+    """Return whether `path` exists and is newer than `original`."""
+    try:
+        return os.stat(path).st_mtime_ns >= os.stat(original).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def resize(original, path, width, format=None):
+    """Write `original` scaled down to `width` to `path`, in `format`
+    if given or else in the format of `original`.
+
+    Returns False, writing nothing, if `original` can be used as it is,
+    being animated or no wider than `width`, and no `format` is given.
+    """
+    with Image.open(original) as image:
+        original_format = image.format
+        if getattr(image, 'is_animated', False) and not format:
+            return False
+
+        # Scale the image as it is shown, the orientation in the EXIF
+        # data is lost when saving.
+        image = ImageOps.exif_transpose(image)
+        if image.width <= width and not format:
+            return False
+
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        elif format and image.mode not in ('RGB', 'RGBA'):
+            image = image.convert(
+                'RGBA' if image.has_transparency_data else 'RGB'
+            )
+
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+
+        if format:
+            save_as, quality = FORMATS[format]
+            image.save(path, save_as, quality=quality)
+        elif original_format == 'JPEG':
+            image.save(path, original_format, quality=JPEG_QUALITY,
+                       optimize=True, progressive=True)
+        else:
+            image.save(path, original_format, optimize=True)
+
+    return True
+
+
+def to_srgb(image, icc_profile):
+    """Return `image` converted from its ICC profile to sRGB, or as it is
+    if it can not be converted."""
+    try:
+        return ImageCms.profileToProfile(
+            image,
+            ImageCms.ImageCmsProfile(io.BytesIO(icc_profile)),
+            ImageCms.createProfile('sRGB'),
+            outputMode='RGBA' if 'A' in image.mode else 'RGB'
+        )
+    except (ImageCms.PyCMSError, OSError, ValueError):
+        return image
+
+
+def optimize(path, max_dimension, quality):
+    """Rewrite the image at `path` turned as it is shown, in sRGB,
+    without metadata and scaled down to at most `max_dimension` on its
+    longest side.
+
+    Returns whether the image was rewritten. Animated images are left as
+    they are, as are images whose rewrite would be larger without any
+    metadata or pixels having been removed.
+    """
+    with Image.open(path) as image:
+        format = image.format
+        if (format not in OPTIMIZED_FORMATS
+                or getattr(image, 'is_animated', False)):
+            return False
+
+        icc_profile = image.info.get('icc_profile')
+        has_metadata = (bool(image.getexif())
+                        or any(key in image.info for key in METADATA_KEYS))
+
+        image = ImageOps.exif_transpose(image)
+        if icc_profile:
+            image = to_srgb(image, icc_profile)
+
+        scaled = max(image.size) > max_dimension
+        if scaled:
+            image.thumbnail((max_dimension, max_dimension),
+                            Image.Resampling.LANCZOS)
+
+        # No metadata is passed on when saving.
+        data = io.BytesIO()
+        if format == 'JPEG':
+            image.save(data, format, quality=quality, optimize=True,
+                       progressive=True)
+        elif format == 'WEBP':
+            image.save(data, format, quality=quality)
+        else:
+            image.save(data, format, optimize=True)
+
+    if (not has_metadata and not scaled
+            and data.tell() >= os.path.getsize(path)):
+        return False
+
+    tmp_path = '{}.{}'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data.getvalue())
+    os.replace(tmp_path, path)
+
+    return True
+
+
+def save_upload(storage, keep_original=False, name=None):
+    """Save the uploaded image `storage` as image_uploads.save() does,
+    optimize it and return its filename.
+
+    With `keep_original`, the file as uploaded is also kept among the
+    originals.
+    """
+    app = flask.current_app
+    filename = util.image_uploads.save(storage, name=name)
+    path = util.image_uploads.path(filename)
+
+    if keep_original:
+        original = os.path.join(originals_dest(app), filename)
+        os.makedirs(os.path.dirname(original), exist_ok=True)
+        shutil.copy2(path, original)
+
+    try:
+        optimize(path, app.config['IMAGE_MAX_DIMENSION'],
+                 app.config['IMAGE_QUALITY'])
+    except (OSError, Image.DecompressionBombError):
+        # Not an image Pillow can read, or too large to decode, keep it
+        # as it is.
+        pass
+
+    return filename
+
+
+def make_derivative(original, path, width, format=None):
+    """Write the derivative of `original` at `width` in `format` to
+    `path`.
+
+    The derivative is written to a temporary file first, so that other
+    processes never see a partly written derivative. Returns False,
+    writing nothing, if `original` is not an image Pillow can read or is
+    too large to decode.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.{}'.format(path, os.getpid(), threading.get_ident())
+
+    try:
+        try:
+            resized = resize(original, tmp_path, width, format)
+        except (OSError, Image.DecompressionBombError):
+            return False
+
+        if not resized:
+            shutil.copyfile(original, tmp_path)
+
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return True
+
+
+def read_metadata(path):
+    """Return the width and height of the image at `path` as shown, and
+    a data url of a tiny copy of it.
+
+    No placeholder is made for images with transparency, as it would be
+    seen through the image.
+    """
+    with Image.open(path) as image:
+        width, height = image.size
+        if image.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+
+        if image.has_transparency_data:
+            return width, height, None
+
+        # Only decode as much of a JPEG as needed.
+        image.draft('RGB', (PLACEHOLDER_WIDTH * 4, PLACEHOLDER_WIDTH * 4))
+        thumbnail = ImageOps.exif_transpose(image).convert('RGB')
+        thumbnail.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH))
+
+    format = 'webp' if 'webp' in AVAILABLE_FORMATS else 'jpeg'
+    data = io.BytesIO()
+    thumbnail.save(data, format, quality=50)
+
+    placeholder = 'data:image/{};base64,{}'.format(
+        format, base64.b64encode(data.getvalue()).decode()
+    )
+    return width, height, placeholder
+
+
+def update_metadata(image, filename=None):
+    """Store the dimensions, size and placeholder of the file of `image`,
+    or of `filename` if given, on it. Whether it is in portrait follows
+    from its dimensions."""
+    path = image.uploads.path(filename or image.filename)
+
+    try:
+        image.size = os.path.getsize(path)
+    except OSError:
+        image.size = None
+
+    try:
+        image.width, image.height, image.placeholder = read_metadata(path)
+    except (OSError, Image.DecompressionBombError):
+        # Missing, not an image Pillow can read, or too large to decode.
+        image.width = image.height = image.placeholder = None
+        return
+
+    image.portrait = image.height > image.width
+
+
+class DerivativeLocks:
+    """A lock per derivative being made, so that concurrent requests
+    for the same derivative make it only once."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def get(self, path):
+        with self.lock:
+            return self.locks.setdefault(path, threading.Lock())
+
+    def release(self, path):
+        with self.lock:
+            self.locks.pop(path, None)
+
+
+locks = DerivativeLocks()
+
+
+def original_path(app, filename):
+    """Return the path of the uploaded image `filename`, or None if there
+    is no such image."""
+    config = app.upload_set_config[util.image_uploads.name]
+    original = werkzeug.security.safe_join(config.destination, filename)
+    if original is None or not os.path.isfile(original):
+        return None
+    return original
+
+
+def make_derivatives(original, paths):
+    """Make the derivatives of `original` at the (width, format, path)
+    in `paths` that are missing or older than the image."""
+    for width, format, path in paths:
+        if not is_fresh(path, original):
+            make_derivative(original, path, width, format)
+
+
+def derivative_job(app, filename):
+    """Return the arguments of make_derivatives() for all widths and
+    formats of `filename`, or None if there is no such image."""
+    original = original_path(app, filename)
+    if original is None:
+        return None
+
+    paths = [(width, format, derivative_path(app, filename, width, format))
+             for width in WIDTHS
+             for format in (None,) + formats_for(filename)]
+    return original, paths
+
+
+class DerivativePool:
+    """Worker processes making derivatives of new images.
+
+    At most `max_pending` images are queued, images beyond that are left
+    to be made when first requested.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.lock = threading.Lock()
+        self.max_workers = 2
+        self.pending = threading.BoundedSemaphore(50)
+
+    def init_app(self, app):
+        self.max_workers = app.config.get('IMAGE_WORKERS', 2)
+        self.pending = threading.BoundedSemaphore(
+            app.config.get('IMAGE_QUEUE_SIZE', 50)
+        )
+
+    def submit(self, original, paths):
+        if not self.pending.acquire(blocking=False):
+            return
+
+        with self.lock:
+            # Started on first use, so that the workers are forked from
+            # the process serving requests.
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers
+                )
+                atexit.register(self.executor.shutdown)
+            executor = self.executor
+
+        try:
+            future = executor.submit(make_derivatives, original, paths)
+        except concurrent.futures.BrokenExecutor:
+            # A worker died, e.g. out of memory. The derivatives are made
+            # when first requested, and new workers for the next image.
+            self.pending.release()
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            executor.shutdown(wait=False)
+            return
+
+        future.add_done_callback(lambda future: self.pending.release())
+
+
+pool = DerivativePool()
+
+
+def make_all_derivatives(app, filenames, workers=None):
+    """Make the missing derivatives of `filenames` in `workers`
+    processes, return the number of images."""
+    jobs = [job for job in (derivative_job(app, filename)
+                            for filename in filenames)
+            if job is not None]
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(make_derivatives, *job) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            # Raise any errors.
+            future.result()
+
+    return len(jobs)
+
+
+def get_derivative(app, filename, width, format=None):
+    """Return the path of the derivative of `filename` at `width` in
+    `format`, making it if missing or older than the image. Returns None
+    if there is no such image, or if it can not be made."""
+    original = original_path(app, filename)
+    if original is None:
+        return None
+
+    path = derivative_path(app, filename, width, format)
+    if is_fresh(path, original):
+        return path
+
+    try:
+        with locks.get(path):
+            # Another request may have made it while we waited.
+            if (not is_fresh(path, original)
+                    and not make_derivative(original, path, width, format)):
+                return None
+    finally:
+        locks.release(path)
+
+    return path
+
+
+def remove_derivatives(app, filename):
+    """Remove the derivatives of `filename`, e.g. when it is replaced."""
+    for width in WIDTHS:
+        for format in (None,) + tuple(FORMATS):
+            try:
+                os.remove(derivative_path(app, filename, width, format))
+            except FileNotFoundError:
+                pass
+
+
+def derivative_view(width, filename):
+    if width not in WIDTHS:
+        flask.abort(404)
+
+    app = flask.current_app
+    format = None
+
+    name, extension = os.path.splitext(filename)
+    if (original_path(app, filename) is None
+            and extension[1:] in formats_for(name)):
+        filename, format = name, extension[1:]
+
+    path = get_derivative(app, filename, width, format)
+    if path is None and format is None:
+        # Not an image that can be resized, serve it as it is. It is
+        # not what the url names, so it is not cached as such.
+        path = original_path(app, filename)
+        if path is None:
+            flask.abort(404)
+        return flask.send_file(path)
+
+    if path is None:
+        flask.abort(404)
+
+    if 'v' in flask.request.args:
+        # Versioned urls change with the image.
+        response = flask.send_file(path, max_age=ONE_YEAR)
+        response.cache_control.immutable = True
+    else:
+        response = flask.send_file(path)
+
+    return response
+
+
+def init_app(app):
+    """Serve derivatives of uploaded images. Must be called after the
+    uploads are configured."""
+    pool.init_app(app)
+    app.jinja_env.globals['image_formats'] = formats_for
+
+    config = app.upload_set_config[util.image_uploads.name]
+    base_path = urlparse(config.base_url).path
+    app.add_url_rule(base_path + 'img<int:width>/<filename>',
+                     endpoint='image_derivative',
+                     view_func=derivative_view)
+
+
+@sqla.event.listens_for(models.Image.filename, 'set')
+def read_image_metadata(target, value, oldvalue, initiator):
+    # Called before the filename is set.
+    update_metadata(target, value)
+
+
+@sqla.event.listens_for(sqla.orm.Session, 'after_flush')
+def note_new_images(session, flush_context):
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, models.Image):
+            continue
+
+        # The version changes when an image is replaced under the same
+        # name.
+        attrs = sqla.inspect(obj).attrs
+        if (attrs.filename.history.has_changes()
+                or attrs.version.history.has_changes()):
+            session.info.setdefault('new_images', set()).add(obj.filename)
+
+
+@sqla.event.listens_for(sqla.orm.Session, 'after_commit')
+def queue_new_images(session):
+    filenames = session.info.pop('new_images', ())
+    if not filenames or not flask.has_app_context():
+        return
+
+    app = flask.current_app._get_current_object()
+    for filename in filenames:
+        job = derivative_job(app, filename)
+        if job is not None:
+            pool.submit(*job)
+
+
+@sqla.event.listens_for(sqla.orm.Session, 'after_rollback')
+def forget_new_images(session):
+    session.info.pop('new_images', None)
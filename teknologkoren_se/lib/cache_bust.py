@@ -24,17 +24,99 @@ DEALINGS IN THE SOFTWARE.
 https://github.com/ChrisTM/Flask-CacheBust
 """
 
-import os
+import concurrent.futures
 import hashlib
+import json
+import os
+
+# Files are hashed in chunks of this many bytes.
+CHUNK_SIZE = 64 * 1024
+
+
+def file_version(path):
+    """Return the version component of the file at `path`."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return 'c' + md5.hexdigest()[:7]
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    tmp_path = '{}.{}'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def compute_versions(static_folder, manifest_path, exclude=()):
+    """Return the version component of each file in `static_folder`, by
+    path relative to it, skipping the directories in `exclude`.
+
+    Versions are kept in a manifest at `manifest_path` with the size and
+    modification time of each file, and only files that have changed
+    since are hashed, in parallel.
+    """
+    exclude = {os.path.abspath(path) for path in exclude}
+    old_manifest = load_manifest(manifest_path)
+    # map from an unbusted filename to [size, mtime, version]
+    manifest = {}
+    changed = []
+
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        dirnames[:] = [
+            dirname for dirname in dirnames
+            if os.path.abspath(os.path.join(dirpath, dirname)) not in exclude
+        ]
+
+        for filename in filenames:
+            rooted_filename = os.path.join(dirpath, filename)
+            unbusted = os.path.relpath(rooted_filename, static_folder)
+
+            stat = os.stat(rooted_filename)
+            key = [stat.st_size, stat.st_mtime_ns]
+
+            entry = old_manifest.get(unbusted)
+            if entry and entry[:2] == key:
+                manifest[unbusted] = entry
+            else:
+                changed.append((unbusted, rooted_filename, key))
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        versions = executor.map(
+            file_version,
+            [rooted_filename for _, rooted_filename, _ in changed]
+        )
+        for (unbusted, _, key), version in zip(changed, versions):
+            manifest[unbusted] = key + [version]
+
+    if manifest != old_manifest:
+        try:
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            save_manifest(manifest_path, manifest)
+        except OSError:
+            # The manifest only saves work, hash again next time.
+            pass
+
+    return {unbusted: entry[2] for unbusted, entry in manifest.items()}
 
 
-def init_cache_busting(app):
+def init_cache_busting(app, exclude=()):
     """
     Configure `app` to so that `url_for` adds a unique prefix to URLs generated
     for the `'static'` endpoint. Also make the app able to serve cache-busted
     static files.
     This allows setting long cache expiration values on static resources
     because whenever the resource changes, so does its URL.
+    Directories in `exclude`, e.g. uploads, are not cache-busted.
     """
     # the rooted path to the static file folder
     static_folder = app.static_folder
@@ -43,24 +125,29 @@ def init_cache_busting(app):
     # map from a busted filename to an unbusted one
     unbust_table = {}
 
+    manifest_path = (
+        app.config.get('CACHE_BUST_MANIFEST')
+        or os.path.join(app.instance_path, 'cache_bust_manifest.json')
+    )
+
     app.logger.debug('Computing cache-busting values...')
     # compute (un)bust tables.
-    for dirpath, dirnames, filenames in os.walk(static_folder):
-        for filename in filenames:
-            # compute version component
-            rooted_filename = os.path.join(dirpath, filename)
-            with open(rooted_filename, 'rb') as f:
-                version = 'c' + hashlib.md5(f.read()).hexdigest()[:7]
-
-            # add version
-            unbusted = os.path.relpath(rooted_filename, static_folder)
-            busted = os.path.join(version, unbusted)
-
-            # save computation to tables
-            bust_table[unbusted] = busted
-            unbust_table[busted] = unbusted
+    versions = compute_versions(static_folder, manifest_path, exclude)
+    for unbusted, version in versions.items():
+        # add version
+        busted = os.path.join(version, unbusted)
+
+        # save computation to tables
+        bust_table[unbusted] = busted
+        unbust_table[busted] = unbusted
     app.logger.debug('Finished computing cache-busting values')
 
+    # Make the tables available to e.g. the static export.
+    app.extensions['cache_bust'] = {
+        'bust_table': bust_table,
+        'unbust_table': unbust_table,
+    }
+
     def bust_filename(filename):
         return bust_table.get(filename, filename)
 
@@ -40,16 +40,23 @@ import re
 name = "mdx_headdown"
 
 
+# Match headings 1-6 case insensitively if they're the entirety of the
+# string, and capture the heading number.
+heading_pattern = re.compile('^h([1-6])$', re.I)
+
+
 class DowngradeHeadingsTreeprocessor(Treeprocessor):
     """ Downgrade headings via the Treeprocessor interface. """
+    def __init__(self, md, config):
+        super(DowngradeHeadingsTreeprocessor, self).__init__(md)
+        # Keep the configuration on the instance, so that several Markdown
+        # instances with different offsets can live side by side.
+        self.config = config
+
     def run(self, root):
         # Ensure the offset value is a positive (or zero) integer.
         offset = abs(int(self.config['offset']))
 
-        # Match headings 1-6 case insensitively if they're the entirety of the
-        # string, and capture the heading number.
-        heading_pattern = re.compile('^h([1-6])$', re.I)
-
         for element in root:
             # Attempt matching each tag against the heading pattern.
             match = heading_pattern.match(element.tag)
@@ -70,13 +77,12 @@ class DowngradeHeadingsExtension(Extension):
         super(DowngradeHeadingsExtension, self).__init__(**kwargs)
 
     def extendMarkdown(self, md):
-        # Register the plugin as a Treeprocessor. """
+        # Register the plugin as a Treeprocessor, giving it access to the
+        # configuration.
         md.treeprocessors.register(
-            DowngradeHeadingsTreeprocessor(md),
+            DowngradeHeadingsTreeprocessor(md, self.getConfigs()),
             'downgradeheadings', 200
         )
-        # And give the actual processor access to the configuration.
-        DowngradeHeadingsTreeprocessor.config = self.getConfigs()
 
 
 def makeExtension(*args, **kwargs):
@@ -1,9 +1,36 @@
+import functools
+
+import babel
+import babel.dates
 import flask
 from werkzeug.exceptions import MethodNotAllowed, NotFound
 from werkzeug.routing import RequestRedirect
 
 from teknologkoren_se.translations import translations
 
+# Number of paths whose match is kept by lang_path_target().
+LANG_PATH_CACHE_SIZE = 1024
+
+# Number of formatted dates kept by format_cached().
+DATE_FORMAT_CACHE_SIZE = 4096
+
+# Datetimes are stored in UTC and shown in Swedish time.
+TIMEZONE = babel.dates.get_timezone('Europe/Stockholm')
+
+
+def compile_translations(translations):
+    """Return a table of strings by name for each language in
+    `translations`."""
+    tables = {}
+    for name, translation in translations.items():
+        for lang_code, string in translation.items():
+            tables.setdefault(lang_code, {})[name] = string
+    return tables
+
+
+# The translated strings of each language, by name.
+strings = compile_translations(translations)
+
 
 class LazyTranslation:
     """For use in things working outside application context.
@@ -15,25 +42,52 @@ class LazyTranslation:
     call to get_locale() until the string is actually rendered.
     """
 
-    def __init__(self, translation):
-        self.translation = translation
+    def __init__(self, name):
+        self.name = name
 
     def __str__(self):
-        return self.translation[get_locale()]
+        return strings[get_locale()][self.name]
 
 
 def get_string(name, lazy=False):
-    translation = translations.get(name)
-    if translation:
-        if lazy:
-            return LazyTranslation(translation)
-        else:
-            return translations[name][get_locale()]
-    else:
+    # Untranslated names are returned without looking up the locale,
+    # so that they work outside application context.
+    if name not in translations:
         return name
 
+    if lazy:
+        return LazyTranslation(name)
+
+    return strings[get_locale()][name]
+
+
+def template_strings():
+    """Context processor binding the strings of the current language to
+    `_` in templates, so that translating does not look up the locale.
+
+    Macros imported without context use the global `_`, get_string().
+    """
+    table = strings[get_locale()]
+    return {'_': lambda name: table.get(name, name)}
+
 
 def get_locale():
+    """Return the language of the current request.
+
+    The language is resolved on the first call in a request and kept in
+    g, see set_lang_code().
+    """
+    try:
+        return flask.g._locale
+    except AttributeError:
+        pass
+
+    lang_code = resolve_locale()
+    flask.g._locale = lang_code
+    return lang_code
+
+
+def resolve_locale():
     lang_code = flask.g.get('lang_code') or flask.session.get('lang_code')
 
     if not lang_code:
@@ -44,6 +98,12 @@ def get_locale():
     return lang_code
 
 
+def set_lang_code(lang_code):
+    """Set the language of the current request."""
+    flask.g.lang_code = lang_code
+    flask.g.pop('_locale', None)
+
+
 def fix_missing_lang_code():
     if flask.g.get('lang_code') or flask.request.endpoint == 'static':
         # Lang code is not missing.
@@ -52,34 +112,100 @@ def fix_missing_lang_code():
     # If g.lang_code is not set, the lang code in path is probably
     # missing or misspelled/invalid.
 
-    # Get a MapAdapter, the object used for matching urls.
-    urls = flask.current_app.url_map.bind(
-        flask.current_app.config['SERVER_NAME']
-    )
-
     # Get whatever lang get_locale() decides (cookie or, if no cookie,
     # default), and prepend it to the requested path.
     proposed_lang = get_locale()
     new_path = proposed_lang + flask.request.path
 
-    try:
-        # Does this new path match any view?
-        urls.match(new_path)
-    except RequestRedirect as e:
-        # The new path results in a redirect.
-        return flask.redirect(e.new_url)
-    except (MethodNotAllowed, NotFound):
+    target = lang_path_target(flask.current_app._get_current_object(),
+                              new_path)
+
+    if target is None:
         # The new path does not match anything, we allow the request
         # to continue with the non-lang path. Probably 404. In case
         # this request results in something that does want a lang
         # code, we set it to whatever was proposed by get_locale().
         # If we don't set it AND the client does not have lang saved
         # in a cookie, we'd get a 500.
-        flask.g.lang_code = proposed_lang
+        set_lang_code(proposed_lang)
         return None
 
-    # The new path matches a view! We redirect there.
-    return flask.redirect(new_path)
+    # The new path matches a view, or redirects to one. We redirect
+    # there.
+    return flask.redirect(target)
+
+
+@functools.lru_cache(maxsize=None)
+def url_adapter(app):
+    """Return a MapAdapter, the object used for matching urls."""
+    return app.url_map.bind(app.config['SERVER_NAME'])
+
+
+@functools.lru_cache(maxsize=LANG_PATH_CACHE_SIZE)
+def lang_path_target(app, path):
+    """Return where a request for `path` should be redirected, or None
+    if `path` does not match any view.
+
+    Results are kept for the most recently requested paths, as requests
+    without lang code are often repeated, or are floods of probes for
+    paths that do not exist.
+    """
+    try:
+        # Does this new path match any view?
+        url_adapter(app).match(path)
+    except RequestRedirect as e:
+        # The new path results in a redirect.
+        return e.new_url
+    except (MethodNotAllowed, NotFound):
+        return None
+
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def babel_locale(lang_code):
+    return babel.Locale.parse(lang_code)
+
+
+@functools.lru_cache(maxsize=DATE_FORMAT_CACHE_SIZE)
+def format_cached(kind, value, format, lang_code):
+    """Return `value` formatted as a `kind` ('date', 'datetime' or
+    'time') with `format` in `lang_code`.
+
+    Babel keeps parsed patterns itself. Results are kept as well, since
+    the same dates are shown on many pages.
+    """
+    locale = babel_locale(lang_code)
+
+    if kind == 'date':
+        return babel.dates.format_date(value, format, locale=locale)
+
+    if kind == 'datetime':
+        return babel.dates.format_datetime(value, format, tzinfo=TIMEZONE,
+                                           locale=locale)
+
+    return babel.dates.format_time(value, format, tzinfo=TIMEZONE,
+                                   locale=locale)
+
+
+def format_value(kind, value, format):
+    if value is None:
+        # Babel formats the current time, which must not be kept.
+        return format_cached.__wrapped__(kind, value, format, get_locale())
+
+    return format_cached(kind, value, format, get_locale())
+
+
+def format_date(value, format):
+    return format_value('date', value, format)
+
+
+def format_datetime(value, format):
+    return format_value('datetime', value, format)
+
+
+def format_time(value, format):
+    return format_value('time', value, format)
 
 
 def url_for_lang(endpoint, lang_code, view_args, fallback='index.index', **args):
@@ -105,5 +231,5 @@ def bp_url_processors(bp):
 
         if lang_code in ('sv', 'en'):
             # Valid lang_code, set the global lang_code and cookie
-            flask.g.lang_code = lang_code
+            set_lang_code(lang_code)
             flask.session['lang_code'] = lang_code
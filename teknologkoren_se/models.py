@@ -4,43 +4,139 @@ import bcrypt
 import flask
 import flask_login
 import flask_sqlalchemy
-import markdown
 import phonenumbers
 import slugify
 import sqlalchemy as sqla
 from sqlalchemy.ext.hybrid import hybrid_property
 
+from teknologkoren_se import rendering, util
+from teknologkoren_se.lib import cache_bust
 from teknologkoren_se.locale import get_locale
 
 db = flask_sqlalchemy.SQLAlchemy()
 
+# Variants that are rendered and stored whenever a text changes, other
+# variants are rendered on demand.
+POST_VARIANTS = (rendering.post_variant(1),)
+PAGE_VARIANTS = (rendering.page_variant,)
+TEASER_VARIANT = rendering.post_variant(1)
+
+
+def store_rendered(target, lang, field, text, variants, **extra):
+    attr = 'rendered_' + lang
+    store = rendering.update(getattr(target, attr), field, text, variants,
+                             **extra)
+    setattr(target, attr, store)
+
+
+def store_teaser(target, lang, text):
+    if text:
+        teaser, more = rendering.teaser(text)
+    else:
+        teaser, more = None, False
+
+    store_rendered(target, lang, 'teaser', teaser, (TEASER_VARIANT,),
+                   more=more)
+
+
+# Languages of the texts shown in each language, in order of preference.
+SHOWN_LANGUAGES = {
+    'sv': ('sv',),
+    'en': ('en', 'sv'),
+}
+
+
+def shown_languages():
+    """Return the languages of texts shown in the current language, in
+    order of preference."""
+    try:
+        return SHOWN_LANGUAGES[get_locale()]
+    except KeyError:
+        flask.abort(500)
+
+
+def localized(obj, field, languages=None):
+    """Return `field` of `obj` in the current language.
+
+    The value of the first of `languages`, by default the languages
+    shown in the current language, that is set is returned.
+    """
+    for lang in languages or shown_languages():
+        value = getattr(obj, field + '_' + lang)
+        if value:
+            return value
+
+    return value
+
+
+def load_rendered(entity):
+    """Return query options loading the rendered html of `entity` that
+    is shown in the current language.
+
+    Texts and rendered html are deferred, as only one or two languages
+    of the html are shown and the texts are only needed when editing.
+    """
+    return [sqla.orm.undefer(getattr(entity, 'rendered_' + lang))
+            for lang in shown_languages()]
+
+
+def rendered_entry(obj, field, variant):
+    """Return the stored rendering of `field` in the current language.
+
+    Returns None if `field` has not been stored for `variant`.
+    """
+    key = rendering.key(field, variant)
+
+    for lang in shown_languages():
+        entry = (getattr(obj, 'rendered_' + lang) or {}).get(key)
+
+        if entry is None or entry['html'] is not None:
+            return entry
+
+    return entry
+
+
+def rendered_html(obj, field, variant, text):
+    """Return stored html of `field` in the current language.
+
+    `text` is a callable returning the source text, used to render the
+    html if it has not been stored for `variant`.
+    """
+    entry = rendered_entry(obj, field, variant)
+
+    if entry is None:
+        source = text()
+        return variant.render(source) if source else ''
+
+    return entry['html'] or ''
+
 
 class Config(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
     frontpage_image_id = db.Column(db.Integer, db.ForeignKey('file.id'))
-    frontpage_image = db.relationship('Image', foreign_keys=frontpage_image_id)
+    frontpage_image = db.relationship(
+        'Image',
+        foreign_keys=frontpage_image_id,
+        lazy='joined'
+    )
 
     flash_sv = db.Column(db.String(100), nullable=True)
     flash_en = db.Column(db.String(100), nullable=True)
     flash_type = db.Column(db.String(10), nullable=True)
 
-    def flash(self):
-        lang = get_locale()
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow)
 
-        if lang == 'sv':
-            return self.flash_sv or self.flash_en
-
-        if lang == 'en':
-            return self.flash_en or self.flash_sv
-
-        flask.abort(500)
+    def flash(self):
+        # Shown in English rather than not at all.
+        return localized(self, 'flash', shown_languages() + ('en',))
 
 
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
-    published = db.Column(db.DateTime, nullable=True)
+    published = db.Column(db.DateTime, nullable=True, index=True)
 
     title_sv = db.Column(db.String(100), nullable=False)
     title_en = db.Column(db.String(100), nullable=True)
@@ -48,8 +144,16 @@ class Post(db.Model):
     slug_sv = db.Column(db.String(200), nullable=False)
     slug_en = db.Column(db.String(200), nullable=True)
 
-    text_sv = db.Column(db.Text, nullable=False)
-    text_en = db.Column(db.Text, nullable=True)
+    # Deferred, see load_rendered().
+    text_sv = sqla.orm.deferred(db.Column(db.Text, nullable=False),
+                                group='text')
+    text_en = sqla.orm.deferred(db.Column(db.Text, nullable=True),
+                                group='text')
+
+    rendered_sv = sqla.orm.deferred(db.Column(db.JSON, nullable=True),
+                                    group='rendered')
+    rendered_en = sqla.orm.deferred(db.Column(db.JSON, nullable=True),
+                                    group='rendered')
 
     image_id = db.Column(db.Integer, db.ForeignKey('file.id'))
     image = db.relationship(
@@ -58,64 +162,56 @@ class Post(db.Model):
         lazy='joined'
     )
 
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow)
+
     type = db.Column(db.String(20))
 
+    __table_args__ = (
+        # Listings of blog posts or events.
+        db.Index('ix_post_type_published', 'type', 'published'),
+    )
+
     __mapper_args__ = {
         'polymorphic_identity': 'post',
         'polymorphic_on': type
     }
 
     def title(self):
-        lang = get_locale()
-
-        if lang == 'sv':
-            return self.title_sv
-
-        if lang == 'en':
-            return self.title_en or self.title_sv
-
-        flask.abort(500)
+        return localized(self, 'title')
 
     def text(self):
-        lang = get_locale()
+        return localized(self, 'text')
 
-        if lang == 'sv':
-            return self.text_sv
+    def html(self, offset=1):
+        return rendered_html(
+            self, 'text', rendering.post_variant(offset), self.text
+        )
 
-        if lang == 'en':
-            return self.text_en or self.text_sv
+    def teaser(self):
+        """Return html of the beginning of the text, and whether the text
+        continues after it."""
+        entry = rendered_entry(self, 'teaser', TEASER_VARIANT)
 
-        flask.abort(500)
+        if entry is None:
+            teaser, more = rendering.teaser(self.text())
+            return TEASER_VARIANT.render(teaser), more
 
-    def html(self, offset=0):
-        return markdown.markdown(
-            self.text(),
-            extensions=[
-                'nl2br',
-                'teknologkoren_se.lib.mdx_headdown',
-                'mdx_linkify'
-            ],
-            extension_configs={
-                'mdx_headdown': {
-                    'offset': offset
-                }
-            }
-        )
+        return entry['html'] or '', entry['more']
+
+    def prerender(self):
+        """Store rendered html of all texts."""
+        store_rendered(self, 'sv', 'text', self.text_sv, POST_VARIANTS)
+        store_rendered(self, 'en', 'text', self.text_en, POST_VARIANTS)
+        store_teaser(self, 'sv', self.text_sv)
+        store_teaser(self, 'en', self.text_en)
 
     def url(self):
         """Return the path to the post."""
         return flask.url_for('public.post', id=self.id)
 
     def slug(self):
-        lang = get_locale()
-
-        if lang == 'sv':
-            return self.slug_sv
-
-        if lang == 'en':
-            return self.slug_en or self.slug_sv
-
-        flask.abort(500)
+        return localized(self, 'slug')
 
     def __str__(self):
         """String representation of the post."""
@@ -137,8 +233,10 @@ class Event(Post):
 
     start_time = db.Column(db.DateTime, nullable=False)
 
-    time_text_sv = db.Column(db.Text, nullable=True)
-    time_text_en = db.Column(db.Text, nullable=True)
+    time_text_sv = sqla.orm.deferred(db.Column(db.Text, nullable=True),
+                                     group='text')
+    time_text_en = sqla.orm.deferred(db.Column(db.Text, nullable=True),
+                                     group='text')
 
     location_sv = db.Column(db.String(100), nullable=False)
     location_en = db.Column(db.String(100), nullable=True)
@@ -150,42 +248,23 @@ class Event(Post):
     }
 
     def location(self):
-        lang = get_locale()
-
-        if lang == 'sv':
-            return self.location_sv
-
-        if lang == 'en':
-            return self.location_en or self.location_sv
-
-        flask.abort(500)
+        return localized(self, 'location')
 
     def time_text(self):
-        lang = get_locale()
-
-        if lang == 'sv':
-            return self.time_text_sv
+        return localized(self, 'time_text')
 
-        if lang == 'en':
-            return self.time_text_en or self.time_text_sv
-
-        flask.abort(500)
-
-    def time_html(self, offset=0):
-        return markdown.markdown(
-            self.time_text(),
-            extensions=[
-                'nl2br',
-                'teknologkoren_se.lib.mdx_headdown',
-                'mdx_linkify'
-            ],
-            extension_configs={
-                'mdx_headdown': {
-                    'offset': offset
-                }
-            }
+    def time_html(self, offset=1):
+        return rendered_html(
+            self, 'time_text', rendering.post_variant(offset), self.time_text
         )
 
+    def prerender(self):
+        super().prerender()
+        store_rendered(self, 'sv', 'time_text', self.time_text_sv,
+                       POST_VARIANTS)
+        store_rendered(self, 'en', 'time_text', self.time_text_en,
+                       POST_VARIANTS)
+
 
 @sqla.event.listens_for(Post.title_sv, 'set', propagate=True)
 def create_slug_sv(target, value, oldvalue, initiator):
@@ -200,49 +279,81 @@ def create_slug_en(target, value, oldvalue, initiator):
         target.slug_en = None
 
 
+@sqla.event.listens_for(Post.text_sv, 'set', propagate=True)
+def render_text_sv(target, value, oldvalue, initiator):
+    store_rendered(target, 'sv', 'text', value, POST_VARIANTS)
+    store_teaser(target, 'sv', value)
+
+
+@sqla.event.listens_for(Post.text_en, 'set', propagate=True)
+def render_text_en(target, value, oldvalue, initiator):
+    store_rendered(target, 'en', 'text', value, POST_VARIANTS)
+    store_teaser(target, 'en', value)
+
+
+@sqla.event.listens_for(Event.time_text_sv, 'set')
+def render_time_text_sv(target, value, oldvalue, initiator):
+    store_rendered(target, 'sv', 'time_text', value, POST_VARIANTS)
+
+
+@sqla.event.listens_for(Event.time_text_en, 'set')
+def render_time_text_en(target, value, oldvalue, initiator):
+    store_rendered(target, 'en', 'time_text', value, POST_VARIANTS)
+
+
 class Page(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    path = db.Column(db.String(50), nullable=False)
+    path = db.Column(db.String(50), nullable=False, index=True)
 
-    text_sv = db.Column(db.Text, nullable=False)
-    text_en = db.Column(db.Text, nullable=False)
+    # Deferred, see load_rendered().
+    text_sv = sqla.orm.deferred(db.Column(db.Text, nullable=False),
+                                group='text')
+    text_en = sqla.orm.deferred(db.Column(db.Text, nullable=False),
+                                group='text')
 
     title_sv = db.Column(db.String(50), nullable=False)
     title_en = db.Column(db.String(50), nullable=False)
 
-    image_id = db.Column(db.Integer, db.ForeignKey('file.id'))
-    image = db.relationship('Image', foreign_keys=image_id)
-
-    def text(self):
-        lang = get_locale()
+    rendered_sv = sqla.orm.deferred(db.Column(db.JSON, nullable=True),
+                                    group='rendered')
+    rendered_en = sqla.orm.deferred(db.Column(db.JSON, nullable=True),
+                                    group='rendered')
 
-        if lang == 'sv':
-            return self.text_sv
+    image_id = db.Column(db.Integer, db.ForeignKey('file.id'))
+    image = db.relationship(
+        'Image',
+        foreign_keys=image_id,
+        lazy='joined'
+    )
 
-        if lang == 'en':
-            return self.text_en or self.text_sv
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow)
 
-        flask.abort(500)
+    def text(self):
+        return localized(self, 'text')
 
     def html(self):
-        return markdown.markdown(
-            self.text(),
-            extensions=[
-                'nl2br',
-                'mdx_linkify'
-            ]
+        return rendered_html(
+            self, 'text', rendering.page_variant, self.text
         )
 
+    def prerender(self):
+        """Store rendered html of all texts."""
+        store_rendered(self, 'sv', 'text', self.text_sv, PAGE_VARIANTS)
+        store_rendered(self, 'en', 'text', self.text_en, PAGE_VARIANTS)
+
     def title(self):
-        lang = get_locale()
+        return localized(self, 'title')
 
-        if lang == 'sv':
-            return self.title_sv
 
-        if lang == 'en':
-            return self.title_en
+@sqla.event.listens_for(Page.text_sv, 'set')
+def render_page_text_sv(target, value, oldvalue, initiator):
+    store_rendered(target, 'sv', 'text', value, PAGE_VARIANTS)
 
-        flask.abort(500)
+
+@sqla.event.listens_for(Page.text_en, 'set')
+def render_page_text_en(target, value, oldvalue, initiator):
+    store_rendered(target, 'en', 'text', value, PAGE_VARIANTS)
 
 
 class File(db.Model):
@@ -251,11 +362,23 @@ class File(db.Model):
 
     filename = db.Column(db.String(256), nullable=False)
 
+    # Version of the uploaded file, added to its urls. Updated when the
+    # filename is set, which is also done when the file is replaced.
+    version = db.Column(db.String(8), nullable=True)
+
+    uploads = util.file_uploads
+
     __mapper_args__ = {
         'polymorphic_identity': 'file',
         'polymorphic_on': type,
     }
 
+    def url(self):
+        return util.url_for_file(self.filename, self.version)
+
+    def update_version(self):
+        self.version = upload_version(self.uploads, self.filename)
+
 
 class Image(File):
     __mapper_args__ = {
@@ -264,6 +387,41 @@ class Image(File):
 
     portrait = db.Column(db.Boolean, nullable=True)
 
+    # Read from the file when the filename is set, see
+    # images.update_metadata(). The dimensions are those of the image as
+    # shown, the placeholder is a data url of a tiny copy of the image.
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    size = db.Column(db.Integer, nullable=True)
+    placeholder = db.Column(db.Text, nullable=True)
+
+    uploads = util.image_uploads
+
+    def url(self, width=None, format=None):
+        return util.url_for_image(self.filename, width, self.version, format)
+
+    def srcset(self, widths, format=None):
+        """Return a srcset of the image at each (width, descriptor) in
+        `widths`."""
+        return ', '.join(
+            '{} {}'.format(self.url(width, format), descriptor).rstrip()
+            for width, descriptor in widths
+        )
+
+
+def upload_version(uploads, filename):
+    """Return the version of `filename` in `uploads`, or None if there
+    is no such file."""
+    try:
+        return cache_bust.file_version(uploads.path(filename))
+    except OSError:
+        return None
+
+
+@sqla.event.listens_for(File.filename, 'set', propagate=True)
+def version_file(target, value, oldvalue, initiator):
+    target.version = upload_version(target.uploads, value)
+
 
 class Contact(db.Model):
     """Should be the board (+ webmaster if you're feeling like it).
@@ -276,26 +434,75 @@ class Contact(db.Model):
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(254), nullable=False)
     phone = db.Column(db.String(20), nullable=True)
-    weight = db.Column(db.Integer, nullable=False)
+    weight = db.Column(db.Integer, nullable=False, index=True)
+
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow)
+
+    # Normalized when phone is set, see normalize_phone().
+    phone_e164 = db.Column(db.String(16), nullable=True)
+    phone_display = db.Column(db.String(30), nullable=True)
 
     def formatted_phone(self):
-        """Returns formatted number or False if not a valid number."""
-        try:
-            # If no country code, assume Swedish
-            parsed = phonenumbers.parse(self.phone, 'SE')
-        except phonenumbers.phonenumberutil.NumberParseException:
-            return None
-
-        if not (phonenumbers.is_possible_number(parsed)
-                and phonenumbers.is_valid_number(parsed)):
-            return None
-
-        formatted = phonenumbers.format_number(
-            parsed,
-            phonenumbers.PhoneNumberFormat.INTERNATIONAL
-        )
+        """Returns formatted number or None if not a valid number."""
+        return self.phone_display
+
+    def normalize_phone(self):
+        self.phone_e164, self.phone_display = normalize_phone(self.phone)
+
+
+def normalize_phone(phone):
+    """Return `phone` in E.164 and international format.
+
+    Returns (None, None) if `phone` is not a valid number.
+    """
+    if not phone:
+        return None, None
+
+    try:
+        # If no country code, assume Swedish
+        parsed = phonenumbers.parse(phone, 'SE')
+    except phonenumbers.phonenumberutil.NumberParseException:
+        return None, None
+
+    if not (phonenumbers.is_possible_number(parsed)
+            and phonenumbers.is_valid_number(parsed)):
+        return None, None
+
+    e164 = phonenumbers.format_number(
+        parsed,
+        phonenumbers.PhoneNumberFormat.E164
+    )
+    formatted = phonenumbers.format_number(
+        parsed,
+        phonenumbers.PhoneNumberFormat.INTERNATIONAL
+    )
+
+    return e164, formatted
+
+
+@sqla.event.listens_for(Contact.phone, 'set')
+def normalize_contact_phone(target, value, oldvalue, initiator):
+    target.phone_e164, target.phone_display = normalize_phone(value)
+
+
+@sqla.event.listens_for(Post, 'before_insert', propagate=True)
+@sqla.event.listens_for(Page, 'before_insert')
+def prerender_new(mapper, connection, target):
+    # Texts that are never set have no stored html, which readers would
+    # render from the deferred texts.
+    target.prerender()
+
 
-        return formatted
+@sqla.event.listens_for(Config, 'before_update')
+@sqla.event.listens_for(Post, 'before_update', propagate=True)
+@sqla.event.listens_for(Page, 'before_update')
+@sqla.event.listens_for(Contact, 'before_update')
+def set_updated_at(mapper, connection, target):
+    # Also called for objects without any net changes.
+    session = sqla.orm.object_session(target)
+    if session.is_modified(target, include_collections=False):
+        target.updated_at = datetime.datetime.utcnow()
 
 
 class AdminUser(flask_login.UserMixin, db.Model):
@@ -0,0 +1,141 @@
+"""Query plans of the queries made by the public views.
+
+The public pages are requested with a test client while recording the
+statements sent to the database, which are then explained with SQLite's
+`EXPLAIN QUERY PLAN`. Plans that may read a whole table or index are
+marked, run this against a database with many posts to see that the
+listings do not. The config table has a single row and is always
+scanned, and the few contacts are all listed in order of their index.
+"""
+
+import re
+
+import flask
+import sqlalchemy as sqla
+
+from teknologkoren_se import export, models, util
+from teknologkoren_se.views import public
+
+LIMIT = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+AGGREGATE = re.compile(r'\b(?:avg|count|group_concat|max|min|sum|total)\s*\(',
+                       re.IGNORECASE)
+# A column constrained by < or >, as in "(type=? AND published<?)".
+RANGE = re.compile(r'(\w+)([<>])')
+
+
+def public_urls():
+    """Return urls of one of each kind of public page.
+
+    The queries are the same for both languages, only Swedish pages are
+    requested.
+    """
+    urls = []
+
+    for endpoint, model in (('public.index', models.Post),
+                            ('public.events', models.Event)):
+        urls.append(flask.url_for(endpoint, lang_code='sv', cursor=None))
+
+        page = util.keyset_paginate(public.published_posts(model), model,
+                                    None, public.POSTS_PER_PAGE)
+        if page.has_next:
+            urls.append(flask.url_for(endpoint, lang_code='sv',
+                                      cursor=page.next_cursor))
+
+    for model in (models.BlogPost, models.Event):
+        post = public.published_posts(model).first()
+        if post is not None:
+            urls.append(export.post_url(post, 'sv'))
+
+    urls.append(flask.url_for('public.contact', lang_code='sv'))
+
+    for path, endpoint in public.DYNAMIC_PAGES:
+        urls.append(flask.url_for('public.' + endpoint, lang_code='sv'))
+
+    return urls
+
+
+def record_statements(app, urls):
+    """Request `urls` and return the statements sent to the database,
+    each with the parameters it was first sent with."""
+    statements = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.setdefault(statement, parameters)
+
+    with app.app_context():
+        engine = models.db.engine
+
+    sqla.event.listen(engine, 'before_cursor_execute', record)
+    try:
+        client = app.test_client()
+        for url in urls:
+            client.get(url)
+    finally:
+        sqla.event.remove(engine, 'before_cursor_execute', record)
+
+    return statements
+
+
+def is_full_scan(statement, detail):
+    """Return whether `detail` of the plan of `statement` may read every
+    row of a table or an index.
+
+    Scans of an index, and searches of a range of it that is open at one
+    end, are in index order and stop at the limit. Without a limit, or
+    with an aggregate over the rows, they read to the end of the index.
+    """
+    bounded = LIMIT.search(statement) and not AGGREGATE.search(statement)
+
+    if detail.startswith('SCAN '):
+        return ' USING ' not in detail or not bounded
+
+    if detail.startswith('SEARCH ') and not bounded:
+        sides = {}
+        for column, side in RANGE.findall(detail):
+            sides.setdefault(column, set()).add(side)
+        return any(len(column_sides) == 1 for column_sides in sides.values())
+
+    return False
+
+
+def explain(statement, parameters):
+    """Return the plan of `statement` as a list of (depth, detail)."""
+    connection = models.db.session.connection()
+    rows = connection.exec_driver_sql(
+        'EXPLAIN QUERY PLAN ' + statement, parameters
+    ).all()
+
+    depths = {0: -1}
+    plan = []
+    for id, parent, _, detail in rows:
+        depths[id] = depths.get(parent, -1) + 1
+        plan.append((depths[id], detail))
+
+    return plan
+
+
+def print_query_plans(app):
+    """Print the plan of each query made by the public views, return
+    the number of plans with full scans."""
+    with app.test_request_context():
+        urls = public_urls()
+
+    statements = record_statements(app, urls)
+
+    scans = 0
+    with app.app_context():
+        for statement, parameters in statements.items():
+            plan = explain(statement, parameters)
+            scan = any(is_full_scan(statement, detail)
+                       for _, detail in plan)
+            scans += scan
+
+            print(statement)
+            for depth, detail in plan:
+                marker = ('  <-- full scan'
+                          if is_full_scan(statement, detail) else '')
+                print('{}{}{}'.format('    ' * (depth + 1), detail, marker))
+            print()
+
+    print("{} queries, {} with full scans".format(len(statements), scans))
+    return scans
@@ -0,0 +1,174 @@
+"""Markdown rendering of posts, events and pages.
+
+Rendered html is stored on the models in their `rendered_<lang>` columns,
+keyed by a hash of the extension configuration. Texts are rendered again
+whenever they are set. See `models.Post.html`.
+"""
+
+import functools
+import hashlib
+import re
+import threading
+
+import markdown
+from bleach.linkifier import Linker
+
+HEADDOWN = 'teknologkoren_se.lib.mdx_headdown'
+
+# Teasers are at most this many blocks and characters of the text.
+TEASER_BLOCKS = 2
+TEASER_LENGTH = 500
+
+# Inline markup that a teaser must not be cut inside of: code spans,
+# links and images, autolinks, strong and emphasis.
+INLINE_MARKUP = re.compile(
+    r'`[^`]*`'
+    r'|!?\[[^\]]*\]\([^)]*\)'
+    r'|<[^>\s]+>'
+    r'|\*\*.+?\*\*|__.+?__'
+    r'|\*[^*\s][^*]*?\*|_[^_\s][^_]*?_'
+)
+
+
+class Variant:
+    """A markdown extension configuration used to render a text.
+
+    Building a `markdown.Markdown` instance means loading and setting up
+    all extensions, so each thread keeps one converter per variant and
+    resets it between uses. Converters are not thread safe and must not
+    be shared between threads.
+    """
+
+    def __init__(self, extensions, configs=None):
+        self.extensions = tuple(extensions)
+        self.configs = configs or {}
+
+        fingerprint = repr((
+            self.extensions,
+            sorted((name, sorted(config.items()))
+                   for name, config in self.configs.items())
+        ))
+        self.key = hashlib.sha1(fingerprint.encode()).hexdigest()[:10]
+
+        self._local = threading.local()
+
+    def converter(self):
+        """Return this thread's converter, creating it if needed."""
+        converter = getattr(self._local, 'converter', None)
+
+        if converter is None:
+            converter = markdown.Markdown(
+                extensions=list(self.extensions),
+                extension_configs=self.configs
+            )
+            reuse_linker(converter)
+            self._local.converter = converter
+
+        return converter
+
+    def render(self, text):
+        return self.converter().reset().convert(text)
+
+
+def reuse_linker(converter):
+    """Make the linkify postprocessor of `converter` reuse one Linker.
+
+    mdx_linkify sets up a new bleach Linker on every conversion. As the
+    converter is only used by one thread, it can keep a single one.
+    """
+    if 'linkify' not in converter.postprocessors:
+        return
+
+    processor = converter.postprocessors['linkify']
+    processor.run = Linker(**processor._linker_options).linkify
+
+
+@functools.lru_cache(maxsize=None)
+def post_variant(offset):
+    """Return the variant used for posts and events.
+
+    Headings are downgraded by `offset` levels.
+    """
+    return Variant(
+        ['nl2br', HEADDOWN, 'mdx_linkify'],
+        {HEADDOWN: {'offset': offset}}
+    )
+
+
+page_variant = Variant(['nl2br', 'mdx_linkify'])
+
+
+def cut_position(text, length):
+    """Return where to cut `text` to at most `length` characters without
+    splitting inline markup.
+
+    A cut inside a code span, link, image or emphasis is moved to before
+    it, unless it starts the text.
+    """
+    for match in INLINE_MARKUP.finditer(text):
+        if match.start() >= length:
+            break
+        if match.end() > length:
+            return match.start() or match.end()
+
+    return length
+
+
+def teaser(text, blocks=TEASER_BLOCKS, length=TEASER_LENGTH):
+    """Return the beginning of markdown `text` and whether it was cut.
+
+    The beginning is as many of the first `blocks` blocks (paragraphs,
+    lists and so on) of the text as fit in `length` characters. A first
+    block longer than that is cut at a word boundary outside of inline
+    markup.
+    """
+    parts = [part for part
+             in re.split(r'\n(?:[ \t]*\n)+', text.replace('\r\n', '\n'))
+             if part.strip()]
+
+    if not parts:
+        return '', False
+
+    used = 1
+    while (used < min(blocks, len(parts))
+           and len('\n\n'.join(parts[:used + 1])) <= length):
+        used += 1
+
+    beginning = '\n\n'.join(parts[:used])
+    more = len(parts) > used
+
+    cut = cut_position(beginning, length)
+    if len(beginning) > cut:
+        if cut == length:
+            beginning = beginning[:cut].rsplit(None, 1)[0]
+        else:
+            beginning = beginning[:cut].rstrip()
+        beginning += ' …'
+        more = True
+
+    return beginning, more
+
+
+def key(field, variant):
+    return '{}:{}'.format(field, variant.key)
+
+
+def update(store, field, text, variants, **extra):
+    """Return a copy of `store` with `text` rendered in all `variants`.
+
+    Entries of earlier renderings of `field` are dropped. If `text` is
+    empty the entries are stored with no html, so that readers know to
+    fall back to another language rather than render anything. Any
+    `extra` values are stored in the entries as well.
+    """
+    prefix = field + ':'
+    store = {k: v for k, v in (store or {}).items()
+             if not k.startswith(prefix)}
+
+    for variant in variants:
+        store[key(field, variant)] = {
+            'html': variant.render(text) if text else None,
+            **extra
+        }
+
+    return store
@@ -0,0 +1,130 @@
+"""Serving of the shipped static files from memory.
+
+The files are read at startup, together with their gzip encoding and,
+if the brotli package is installed, their brotli encoding. Requests for
+cache busted names are answered from memory. The content behind such a
+name never changes, so it may be cached forever.
+
+Requests for files by their plain names, and for uploads, are served
+from disk as usual.
+"""
+
+import gzip
+import mimetypes
+import os
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Types that are not already compressed.
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+    'image/vnd.microsoft.icon',
+    'image/x-icon',
+)
+
+# Encodings in order of preference.
+ENCODINGS = ('br', 'gzip')
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+def encode(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class Asset:
+    """A static file and its encodings."""
+
+    def __init__(self, data, mimetype, version):
+        self.mimetype = mimetype
+        self.version = version
+        self.encodings = {'identity': data}
+
+        if not mimetype.startswith(COMPRESSIBLE_TYPES):
+            return
+
+        for encoding in ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+
+            encoded = encode(data, encoding)
+            if len(encoded) < len(data):
+                self.encodings[encoding] = encoded
+
+    def negotiate(self, accept_encodings):
+        """Return the best of the encodings accepted by the client."""
+        best, best_quality = 'identity', 0
+        for encoding in ENCODINGS:
+            quality = accept_encodings[encoding]
+            if encoding in self.encodings and quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def response(self):
+        encoding = self.negotiate(flask.request.accept_encodings)
+
+        response = flask.current_app.response_class(
+            self.encodings[encoding],
+            mimetype=self.mimetype
+        )
+
+        if encoding != 'identity':
+            response.content_encoding = encoding
+        if len(self.encodings) > 1:
+            response.vary.add('Accept-Encoding')
+
+        response.cache_control.public = True
+        response.cache_control.max_age = ONE_YEAR
+        response.cache_control.immutable = True
+        response.set_etag('{}-{}'.format(self.version, encoding))
+
+        return response.make_conditional(flask.request)
+
+
+def load_assets(app):
+    """Return the files in the bust table of `app`, by busted name."""
+    bust_table = app.extensions['cache_bust']['bust_table']
+    assets = {}
+
+    for unbusted, busted in bust_table.items():
+        with open(os.path.join(app.static_folder, unbusted), 'rb') as f:
+            data = f.read()
+
+        mimetype = (mimetypes.guess_type(unbusted)[0]
+                    or 'application/octet-stream')
+        version = busted.split(os.sep, 1)[0]
+
+        assets[busted] = Asset(data, mimetype, version)
+
+    return assets
+
+
+def init_app(app):
+    """Serve busted static files of `app` from memory.
+
+    Must be called after cache busting is set up. Not used in debug
+    mode, where files may change while the app is running.
+    """
+    if app.debug or not app.config['STATIC_IN_MEMORY']:
+        return
+
+    assets = load_assets(app)
+    static_view = app.view_functions['static']
+
+    def in_memory_static_view(filename):
+        asset = assets.get(filename)
+        if asset is None:
+            return static_view(filename=filename)
+        return asset.response()
+
+    app.view_functions['static'] = in_memory_static_view
@@ -81,6 +81,10 @@ translations = {
         'en': "Published",
         'sv': "Publicerad",
     },
+    'read more': {
+        'en': "Read more",
+        'sv': "Läs mer",
+    },
 
     # Events
     'time': {
@@ -1,33 +1,156 @@
+import datetime
+
 import flask
 import flask_uploads
+import sqlalchemy as sqla
 from urllib.parse import urlparse, urljoin
 
 file_uploads = flask_uploads.UploadSet('files', flask_uploads.ALL)
 image_uploads = flask_uploads.UploadSet('images', flask_uploads.IMAGES)
 
 
-def url_for_other_page(page):
-    """Return url for a page number."""
+def url_for_cursor(cursor):
+    """Return url for the page at `cursor` of the current listing."""
     args = flask.request.view_args.copy()
-    args['page'] = page
+    args['cursor'] = cursor
     return flask.url_for(flask.request.endpoint, **args)
 
 
-def url_for_file(filename):
+def encode_cursor(published, id):
+    return '{:%Y%m%d%H%M%S%f}-{}'.format(published, id)
+
+
+def decode_cursor(cursor):
+    """Return publishing time and id of `cursor`, abort if invalid."""
+    try:
+        published, id = cursor.split('-')
+        return datetime.datetime.strptime(published, '%Y%m%d%H%M%S%f'), int(id)
+    except ValueError:
+        flask.abort(404)
+
+
+class KeysetPage:
+    """A page of posts, ordered by publishing time and id.
+
+    A page starts at a cursor, the publishing time and id of the last
+    post of the page before it. Pages are found by seeking to the cursor
+    rather than counting and skipping rows, so fetching a page costs the
+    same no matter how far back it is.
+    """
+
+    def __init__(self, items, cursor, has_next, prev_cursor):
+        self.items = items
+        self.cursor = cursor
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_prev(self):
+        return self.cursor is not None
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        last = self.items[-1]
+        return encode_cursor(last.published, last.id)
+
+
+def keyset_paginate(query, model, cursor, per_page):
+    """Return the page of `query` starting at `cursor`.
+
+    `cursor` must be the key of a post in `query`, or None for the first
+    page. Aborts with 404 for unknown cursors, so that there is one page
+    per post at most.
+    """
+    # The id of the post table, rather than of the table of a subclass,
+    # so that the posts are in the order of the (type, published) index.
+    id_column = sqla.inspect(model).primary_key[0]
+
+    key = sqla.tuple_(model.published, id_column)
+    keys = query.with_entities(model.published, id_column)
+
+    items = query.order_by(model.published.desc(), id_column.desc())
+
+    if cursor is not None:
+        published, id = decode_cursor(cursor)
+        if not keys.filter(id_column == id,
+                           model.published == published).first():
+            flask.abort(404)
+
+        items = items.filter(key < sqla.tuple_(published, id))
+
+    # Fetch one more than needed to see if there is a next page.
+    items = items.limit(per_page + 1).all()
+    has_next = len(items) > per_page
+    items = items[:per_page]
+
+    prev_cursor = None
+    if cursor is not None:
+        if not items:
+            flask.abort(404)
+
+        # The page before ends with the post right before the first one
+        # on this page, and starts at the post before that page.
+        first = items[0]
+        newer = (
+            keys.filter(key > sqla.tuple_(first.published, first.id))
+            .order_by(model.published, id_column)
+            .limit(per_page + 1)
+            .all()
+        )
+        if len(newer) > per_page:
+            prev_cursor = encode_cursor(*newer[per_page])
+
+    return KeysetPage(items, cursor, has_next, prev_cursor)
+
+
+def cursor_for_page(query, model, page, per_page):
+    """Return the cursor of page number `page`, or None for the first.
+
+    Only used to redirect old page number urls, as it has to skip all
+    posts on the pages before.
+    """
+    if page <= 1:
+        return None
+
+    id_column = sqla.inspect(model).primary_key[0]
+    last = (
+        query.with_entities(model.published, id_column)
+        .order_by(model.published.desc(), id_column.desc())
+        .offset((page - 1) * per_page - 1)
+        .first()
+    )
+    if last is None:
+        flask.abort(404)
+
+    return encode_cursor(*last)
+
+
+def versioned_url(url, version):
+    """Add `version` to `url`, so that it changes with the file."""
+    if version:
+        return '{}?v={}'.format(url, version)
+    return url
+
+
+def url_for_file(filename, version=None):
     base = file_uploads.config.base_url
     url = urljoin(base, filename)
-    return url
+    return versioned_url(url, version)
 
 
-def url_for_image(filename, width=None):
+def url_for_image(filename, width=None, version=None, format=None):
     base = image_uploads.config.base_url
 
-    if width and not flask.current_app.debug:
+    if width and format:
+        url = urljoin(base, 'img{}/{}.{}'.format(width, filename, format))
+    elif width:
         url = urljoin(base, 'img{}/{}'.format(width, filename))
     else:
         url = urljoin(base, filename)
 
-    return url
+    return versioned_url(url, version)
 
 
 def is_safe_url(target):
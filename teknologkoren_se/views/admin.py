@@ -4,7 +4,7 @@ import flask
 import flask_login
 import pytz
 
-from teknologkoren_se import forms, models, util
+from teknologkoren_se import forms, images, models, util
 
 mod = flask.Blueprint(
     'admin',
@@ -18,7 +18,7 @@ login_manager.login_message_category = 'info'
 
 
 def setup_jinja(app):
-    app.jinja_env.globals['url_for_other_page'] = util.url_for_other_page
+    app.jinja_env.globals['url_for_cursor'] = util.url_for_cursor
     app.jinja_env.globals['image_url'] = util.image_uploads.url
     app.jinja_env.globals['image_dest'] = lambda: util.image_uploads.config.base_url
 
@@ -71,11 +71,11 @@ def frontpage():
 
     if form.validate_on_submit():
         if form.frontpage_image.image.data:
-            filename = util.image_uploads.save(form.frontpage_image.image.data)
-            image = models.Image(
-                filename=filename,
-                portrait=False
+            filename = images.save_upload(
+                form.frontpage_image.image.data,
+                form.frontpage_image.keep_original.data
             )
+            image = models.Image(filename=filename)
             models.db.session.add(image)
 
             config.frontpage_image = image
@@ -163,8 +163,9 @@ def post(post_id=None):
     class F(forms.EditPostForm):
         pass
 
-    images = models.Image.query.all()
-    choose_image_field = forms.choose_image_field(images, current_image_choice)
+    all_images = models.Image.query.all()
+    choose_image_field = forms.choose_image_field(all_images,
+                                                  current_image_choice)
     setattr(F, 'choose_image', choose_image_field)
 
     form = F(obj=post)
@@ -185,11 +186,11 @@ def post(post_id=None):
         post.text_en = forms.none_if_space(form.text_en.data)
 
         if form.image.data:
-            filename = util.image_uploads.save(form.image.data)
+            filename = images.save_upload(form.image.data,
+                                          form.keep_original.data)
             image = models.Image(filename=filename)
             models.db.session.add(image)
 
-            image.portrait = form.portrait.data
             post.image = image
 
         elif int(form.choose_image.data) != post.image_id:
@@ -199,9 +200,6 @@ def post(post_id=None):
             else:
                 post.image_id = choose_image
 
-        elif post.image:
-            post.image.portrait = form.portrait.data
-
         if not post_id:
             models.db.session.add(post)
 
@@ -217,9 +215,6 @@ def post(post_id=None):
     else:
         forms.flash_errors(form)
 
-    if post and post.image:
-        form.portrait.data = post.image.portrait
-
     # If form was submitted, display the new form data, else convert utc to cet
     # Gets converted back to utc from cet on submit that got through validation
     if post and post.published and not form.is_submitted():
@@ -245,8 +240,9 @@ def event(event_id=None):
     class F(forms.EditEventForm):
         pass
 
-    images = models.Image.query.all()
-    choose_image_field = forms.choose_image_field(images, current_image_choice)
+    all_images = models.Image.query.all()
+    choose_image_field = forms.choose_image_field(all_images,
+                                                  current_image_choice)
     setattr(F, 'choose_image', choose_image_field)
 
     form = F(obj=event)
@@ -277,11 +273,11 @@ def event(event_id=None):
         event.location_link = forms.none_if_space(form.location_link.data)
 
         if form.image.data:
-            filename = util.image_uploads.save(form.image.data)
+            filename = images.save_upload(form.image.data,
+                                          form.keep_original.data)
             image = models.Image(filename=filename)
             models.db.session.add(image)
 
-            image.portrait = form.portrait.data
             event.image = image
 
         elif int(form.choose_image.data) != event.image_id:
@@ -291,9 +287,6 @@ def event(event_id=None):
             else:
                 event.image_id = choose_image
 
-        elif event.image:
-            event.image.portrait = form.portrait.data
-
         if not event_id:
             models.db.session.add(event)
 
@@ -309,9 +302,6 @@ def event(event_id=None):
     else:
         forms.flash_errors(form)
 
-    if event and event.image:
-        form.portrait.data = event.image.portrait
-
     # If form was submitted, display the new form data, else convert utc to cet
     # Gets converted back to utc from cet on submit that got through validation
     if event and not form.is_submitted():
@@ -362,11 +352,9 @@ def page(page_id=None):
         page.text_en = form.text_en.data
 
         if form.image.data:
-            filename = util.image_uploads.save(form.image.data)
-            image = models.Image(
-                filename=filename,
-                portrait=form.portrait.data
-            )
+            filename = images.save_upload(form.image.data,
+                                          form.keep_original.data)
+            image = models.Image(filename=filename)
             models.db.session.add(image)
 
             page.image = image
@@ -517,13 +505,15 @@ def image(file_id=None):
         if form.image.data:
             if file_id and form.keep_filename.data:
                 os.remove(util.image_uploads.path(image.filename))
-                filename = util.image_uploads.save(form.image.data, name=image.filename)
+                images.remove_derivatives(flask.current_app, image.filename)
+                filename = images.save_upload(form.image.data,
+                                              form.keep_original.data,
+                                              name=image.filename)
             else:
-                filename = util.image_uploads.save(form.image.data)
+                filename = images.save_upload(form.image.data,
+                                              form.keep_original.data)
             image.filename = filename
 
-        image.portrait = form.portrait.data
-
         if not file_id:
             models.db.session.add(image)
         models.db.session.commit()
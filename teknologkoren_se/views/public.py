@@ -2,8 +2,9 @@ import datetime
 
 import flask
 import flask_login
+import sqlalchemy as sqla
 
-from teknologkoren_se import forms, models, util, locale
+from teknologkoren_se import cache, forms, models, util, locale
 from teknologkoren_se.locale import get_string
 
 mod = flask.Blueprint(
@@ -14,54 +15,153 @@ mod = flask.Blueprint(
 
 locale.bp_url_processors(mod)
 
+POSTS_PER_PAGE = 5
+
+# (path, endpoint) of pages editable in admin.
+DYNAMIC_PAGES = [('om-oss', 'about'), ('boka', 'hire'),
+                 ('sjung', 'apply'), ('lucia', 'lucia'),
+                 ('jubileum', 'jubileum')]
+
 
 def setup_jinja(app):
-    app.jinja_env.globals['url_for_other_page'] = util.url_for_other_page
+    app.jinja_env.globals['url_for_cursor'] = util.url_for_cursor
     app.jinja_env.globals['image_url'] = util.image_uploads.url
     app.jinja_env.globals['image_dest'] = lambda: (util.image_uploads.config
                                                    .base_url)
 
 
-@mod.route('/', defaults={'page': 1})
-@mod.route('/blogg/sida/<int:page>')
-def index(page):
-    posts = (
-        models.Post.query
-        .filter(models.Post.published < datetime.datetime.utcnow())
-        .order_by(models.Post.published.desc())
+def post_type(model):
+    """Return criteria selecting the posts of `model`.
+
+    The type is implied by the join with the table of `model`, but
+    filtering on it lets the (type, published) index find the posts.
+    """
+    if model is models.Post:
+        return ()
+    return (models.Post.type == model.__mapper__.polymorphic_identity,)
+
+
+def posts_validators(model):
+    """Return validators of the published posts of `model`.
+
+    Edits and deletions of posts change the generation, which the
+    validators are combined with. Only posts being published as time
+    passes must be looked up, the latest is found at the end of the
+    published index.
+    """
+    published = (
+        models.db.session.query(model.published)
+        .filter(*post_type(model),
+                model.published < datetime.datetime.utcnow())
+        .order_by(model.published.desc())
+        .limit(1)
+        .scalar()
+    )
+    return (published,)
+
+
+def post_validators(model, post_id):
+    """Return validators of a published post of `model`, or None."""
+    post = (
+        models.db.session.query(model.updated_at, model.published)
+        .filter(model.id == post_id)
+        .first()
+    )
+
+    if (not post or not post.published
+            or post.published > datetime.datetime.utcnow()):
+        return None
+
+    return (cache.latest(post.updated_at, post.published),)
+
+
+def index_validators(cursor):
+    last_modified, = posts_validators(models.Post)
+    config = cache.get_config()
+    return (cache.latest(last_modified, config.updated_at),)
+
+
+def published_posts(model):
+    entity = model
+    if model is models.Post:
+        # Listings of all posts show the details of events, load them
+        # with the posts.
+        entity = sqla.orm.with_polymorphic(models.Post, [models.Event])
+
+    return (
+        models.db.session.query(entity)
+        .options(*models.load_rendered(entity))
+        .filter(
+            *post_type(model),
+            model.published < datetime.datetime.utcnow()
+        )
     )
 
-    config = models.Config.query.first()
+
+@mod.route('/', defaults={'cursor': None})
+@mod.route('/blogg/fore/<cursor>')
+@cache.cached
+@cache.conditional(index_validators)
+def index(cursor):
+    posts = published_posts(models.Post)
+
+    config = cache.get_config()
     frontpage_flash = config.flash()
     if frontpage_flash:
         flask.flash(frontpage_flash, config.flash_type or 'info')
 
-    pagination = posts.paginate(page=page, per_page=5)
+    pagination = util.keyset_paginate(posts, models.Post, cursor,
+                                      POSTS_PER_PAGE)
     return flask.render_template('public/index.html',
                                  image=config.frontpage_image,
-                                 pagination=pagination,
-                                 page=page)
-
+                                 pagination=pagination)
 
-@mod.route('/konserter/', defaults={'page': 1})
-@mod.route('/konserter/sida/<int:page>')
-def events(page):
-    events = (
-        models.Event.query
-        .filter(models.Event.published < datetime.datetime.utcnow())
-        .order_by(models.Event.published.desc())
-    )
 
-    pagination = events.paginate(page=page, per_page=5)
+@mod.route('/blogg/sida/<int:page>')
+def index_page(page):
+    """Redirect old page number urls.
+
+    The redirect is temporary, as the cursor of a page number changes
+    with every published post.
+    """
+    cursor = util.cursor_for_page(published_posts(models.Post), models.Post,
+                                  page, POSTS_PER_PAGE)
+    return flask.redirect(flask.url_for('public.index', cursor=cursor), 302)
+
+
+@mod.route('/konserter/', defaults={'cursor': None})
+@mod.route('/konserter/fore/<cursor>')
+@cache.cached
+@cache.conditional(lambda cursor: posts_validators(models.Event))
+def events(cursor):
+    events = published_posts(models.Event)
+
+    pagination = util.keyset_paginate(events, models.Event, cursor,
+                                      POSTS_PER_PAGE)
     return flask.render_template('public/events.html',
-                                 pagination=pagination,
-                                 page=page)
+                                 pagination=pagination)
+
+
+@mod.route('/konserter/sida/<int:page>')
+def events_page(page):
+    """Redirect old page number urls."""
+    cursor = util.cursor_for_page(published_posts(models.Event),
+                                  models.Event, page, POSTS_PER_PAGE)
+    return flask.redirect(flask.url_for('public.events', cursor=cursor), 302)
 
 
 @mod.route('/blogg/<int:post_id>/')
 @mod.route('/blogg/<int:post_id>/<slug>')
+@cache.cached
+@cache.conditional(
+    lambda post_id, slug=None: post_validators(models.BlogPost, post_id)
+)
 def view_post(post_id, slug=None):
-    post = models.BlogPost.query.get_or_404(post_id)
+    post = (
+        models.BlogPost.query
+        .options(*models.load_rendered(models.BlogPost))
+        .get_or_404(post_id)
+    )
 
     if not post.published or post.published > datetime.datetime.utcnow():
         return flask.abort(404)
@@ -82,8 +182,16 @@ def view_post(post_id, slug=None):
 
 @mod.route('/konserter/<int:event_id>/')
 @mod.route('/konserter/<int:event_id>/<slug>')
+@cache.cached
+@cache.conditional(
+    lambda event_id, slug=None: post_validators(models.Event, event_id)
+)
 def view_event(event_id, slug=None):
-    event = models.Event.query.get_or_404(event_id)
+    event = (
+        models.Event.query
+        .options(*models.load_rendered(models.Event))
+        .get_or_404(event_id)
+    )
 
     if not event.published or event.published > datetime.datetime.utcnow():
         return flask.abort(404)
@@ -102,14 +210,25 @@ def view_event(event_id, slug=None):
     return flask.render_template('public/view_post.html', post=event)
 
 
+def contact_validators():
+    return (
+        models.db.session.query(models.db.func.max(models.Contact.updated_at))
+        .scalar(),
+    )
+
+
 @mod.route('/kontakt')
+@cache.cached
+@cache.conditional(contact_validators)
 def contact():
     contacts = (
         models.Contact.query.
         order_by(models.Contact.weight.desc())
         .all()
     )
-    ordf = models.Contact.query.filter_by(title='Ordförande').first()
+    ordf = min((contact for contact in contacts
+                if contact.title == 'Ordförande'),
+               key=lambda contact: contact.id, default=None)
 
     return flask.render_template('public/contact.html',
                                  contacts=contacts,
@@ -117,9 +236,21 @@ def contact():
 
 
 def view_page_factory(path, endpoint):
+    def page_validators():
+        updated_at = (
+            models.db.session.query(models.Page.updated_at)
+            .filter_by(path=path)
+            .scalar()
+        )
+        if updated_at is None:
+            return None
+        return (updated_at,)
+
+    @cache.conditional(page_validators)
     def view_page():
         page = (
             models.Page.query
+            .options(*models.load_rendered(models.Page))
             .filter_by(path=path)
             .first_or_404()
         )
@@ -131,15 +262,12 @@ def view_page_factory(path, endpoint):
             endpoint=flask.request.endpoint
         )
 
-    return (path, endpoint, view_page)
+    return (path, endpoint, cache.cached(view_page))
 
 
 def init_dynamic_pages():
-    pages = [('om-oss', 'about'), ('boka', 'hire'),
-             ('sjung', 'apply'), ('lucia', 'lucia'),
-             ('jubileum', 'jubileum')]
-    for endpoint, path in pages:
-        view_func = view_page_factory(endpoint, path)
+    for path, endpoint in DYNAMIC_PAGES:
+        view_func = view_page_factory(path, endpoint)
         mod.add_url_rule(*view_func)
 
 